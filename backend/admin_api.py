@@ -1,59 +1,24 @@
-import os
 from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
-import jwt
-import psycopg
-from fastapi import APIRouter, HTTPException, Request
-from psycopg.rows import dict_row
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
 
-router = APIRouter()
-
-JWT_COOKIE_NAME = "rh_session"
-
-
-def _get_dsn() -> str:
-    dsn = os.getenv("DATABASE_URL") or os.getenv("POSTGRES_URL") or ""
-    if not dsn:
-        raise HTTPException(status_code=500, detail="DATABASE_URL is not set")
-    return dsn
-
+from db import get_pool
+from session import JWT_COOKIE_NAME, admin_user_ids, decode_session_jwt
 
-def _connect() -> psycopg.Connection:
-    return psycopg.connect(_get_dsn(), row_factory=dict_row)
-
-
-def _jwt_secret() -> str:
-    secret = os.getenv("JWT_SECRET", "").strip()
-    if not secret:
-        raise HTTPException(status_code=500, detail="JWT_SECRET is not set")
-    return secret
-
-
-def _decode_session_jwt(token: str) -> Dict[str, Any]:
-    try:
-        return jwt.decode(token, _jwt_secret(), algorithms=["HS256"])
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid session")
-
-
-def _admin_user_ids() -> set[str]:
-    raw = os.getenv("DEV_USER_IDS", "").strip()
-    if not raw:
-        return set()
-    return {x.strip() for x in raw.split(",") if x.strip()}
+router = APIRouter()
 
 
 def _require_admin(request: Request) -> Dict[str, Any]:
     token = request.cookies.get(JWT_COOKIE_NAME, "")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    claims = _decode_session_jwt(token)
+    claims = decode_session_jwt(token)
     uid = str(claims.get("sub") or "")
     if not uid:
         raise HTTPException(status_code=401, detail="Invalid session")
-    is_admin = uid in _admin_user_ids()
+    is_admin = uid in admin_user_ids()
     if not is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     return {
@@ -109,33 +74,25 @@ class AllianceMembershipAssignBody(BaseModel):
     role: str = Field(default="member", min_length=3, max_length=24)
 
 
-def ensure_admin_tables():
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.admin_feedback_notes (
-                    id BIGSERIAL PRIMARY KEY,
-                    note_text TEXT NOT NULL,
-                    created_by_discord_user_id TEXT NOT NULL,
-                    created_by_discord_username TEXT NOT NULL,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
-                );
-                """
-            )
-        conn.commit()
-    finally:
-        conn.close()
+def ensure_admin_tables(cur: Any) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.admin_feedback_notes (
+            id BIGSERIAL PRIMARY KEY,
+            note_text TEXT NOT NULL,
+            created_by_discord_user_id TEXT NOT NULL,
+            created_by_discord_username TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
 
 
 @router.get("/api/admin/overview")
-def admin_overview(request: Request):
-    user = _require_admin(request)
+def admin_overview(user: Dict[str, Any] = Depends(_require_admin)):
     now = datetime.now(timezone.utc)
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             has_nw_latest = _table_exists(cur, "public.nw_latest")
             counts = {
@@ -194,17 +151,13 @@ def admin_overview(request: Request):
                 "Use rankings_age_seconds/nw_tick_age_seconds to monitor poll freshness.",
             ],
         }
-    finally:
-        conn.close()
 
 
 @router.get("/api/admin/notes")
-def list_admin_notes(request: Request, limit: int = 200):
-    _require_admin(request)
+def list_admin_notes(limit: int = 200, user: Dict[str, Any] = Depends(_require_admin)):
     safe_limit = max(1, min(int(limit), 500))
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -218,19 +171,15 @@ def list_admin_notes(request: Request, limit: int = 200):
             rows = cur.fetchall()
 
         return {"ok": True, "notes": rows}
-    finally:
-        conn.close()
 
 
 @router.post("/api/admin/notes")
-def create_admin_note(body: AdminNoteBody, request: Request):
-    user = _require_admin(request)
+def create_admin_note(body: AdminNoteBody, user: Dict[str, Any] = Depends(_require_admin)):
     note_text = body.note.strip()
     if not note_text:
         raise HTTPException(status_code=400, detail="Note cannot be empty")
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -249,20 +198,16 @@ def create_admin_note(body: AdminNoteBody, request: Request):
             created = cur.fetchone()
         conn.commit()
         return {"ok": True, "note": created}
-    finally:
-        conn.close()
 
 
 @router.post("/api/admin/alliances")
-def create_alliance(body: AllianceCreateBody, request: Request):
-    _require_admin(request)
+def create_alliance(body: AllianceCreateBody, user: Dict[str, Any] = Depends(_require_admin)):
     name = body.name.strip()
     slug = body.slug.strip().lower()
     if not name or not slug:
         raise HTTPException(status_code=400, detail="name and slug are required")
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -276,15 +221,11 @@ def create_alliance(body: AllianceCreateBody, request: Request):
             row = cur.fetchone()
         conn.commit()
         return {"ok": True, "alliance": row}
-    finally:
-        conn.close()
 
 
 @router.get("/api/admin/alliances")
-def list_alliances(request: Request):
-    _require_admin(request)
-    conn = _connect()
-    try:
+def list_alliances(user: Dict[str, Any] = Depends(_require_admin)):
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -299,19 +240,15 @@ def list_alliances(request: Request):
             )
             rows = cur.fetchall()
         return {"ok": True, "alliances": rows}
-    finally:
-        conn.close()
 
 
 @router.post("/api/admin/alliances/memberships")
-def assign_alliance_membership(body: AllianceMembershipAssignBody, request: Request):
-    _require_admin(request)
+def assign_alliance_membership(body: AllianceMembershipAssignBody, user: Dict[str, Any] = Depends(_require_admin)):
     uid = body.discord_user_id.strip()
     uname = body.discord_username.strip()
     role = body.role.strip().lower() or "member"
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -343,18 +280,14 @@ def assign_alliance_membership(body: AllianceMembershipAssignBody, request: Requ
             row = cur.fetchone()
         conn.commit()
         return {"ok": True, "membership": row}
-    finally:
-        conn.close()
 
 
 @router.get("/api/admin/users")
-def list_app_users(request: Request, limit: int = 500, search: str = ""):
-    _require_admin(request)
+def list_app_users(limit: int = 500, search: str = "", user: Dict[str, Any] = Depends(_require_admin)):
     lim = max(1, min(int(limit), 2000))
     s = search.strip()
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             if s:
                 like = f"%{s}%"
@@ -443,5 +376,3 @@ def list_app_users(request: Request, limit: int = 500, search: str = ""):
             )
 
         return {"ok": True, "users": out}
-    finally:
-        conn.close()
@@ -1,24 +1,28 @@
-import json
+import hashlib
 import os
 import re
+import threading
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
+from http.cookiejar import CookieJar, DefaultCookiePolicy
 from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import urlencode
 
 import httpx
 import jwt
-import psycopg
+import orjson
 from cryptography.fernet import Fernet, InvalidToken
-from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import RedirectResponse
-from psycopg.rows import dict_row
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import RedirectResponse, Response
 from pydantic import BaseModel, Field
 
+from db import get_pool
+from session import JWT_COOKIE_NAME, admin_user_ids, decode_session_jwt, forget_session, session_signing_key
+
 router = APIRouter()
 
 DISCORD_API_BASE = "https://discord.com/api"
-JWT_COOKIE_NAME = "rh_session"
 
 
 class KGConnectBody(BaseModel):
@@ -31,44 +35,20 @@ class AllianceSwitchBody(BaseModel):
     alliance_id: int = Field(..., gt=0)
 
 
-def _get_dsn() -> str:
-    dsn = os.getenv("DATABASE_URL") or os.getenv("POSTGRES_URL") or ""
-    if not dsn:
-        raise HTTPException(status_code=500, detail="DATABASE_URL is not set")
-    return dsn
-
-
-def _connect() -> psycopg.Connection:
-    return psycopg.connect(_get_dsn(), row_factory=dict_row)
-
-
-def ensure_auth_tables():
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.user_kg_connections (
-                    discord_user_id TEXT PRIMARY KEY,
-                    discord_username TEXT,
-                    account_id BIGINT NOT NULL,
-                    kingdom_id BIGINT NOT NULL,
-                    token_enc TEXT NOT NULL,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
-                );
-                """
-            )
-        conn.commit()
-    finally:
-        conn.close()
-
-
-def _jwt_secret() -> str:
-    secret = os.getenv("JWT_SECRET", "").strip()
-    if not secret:
-        raise HTTPException(status_code=500, detail="JWT_SECRET is not set")
-    return secret
+def ensure_auth_tables(cur: Any) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.user_kg_connections (
+            discord_user_id TEXT PRIMARY KEY,
+            discord_username TEXT,
+            account_id BIGINT NOT NULL,
+            kingdom_id BIGINT NOT NULL,
+            token_enc TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
 
 
 def _jwt_exp_hours() -> int:
@@ -78,6 +58,18 @@ def _jwt_exp_hours() -> int:
         return 168
 
 
+# Session lifetime and cookie flags are fixed for the life of the process;
+# resolve them once rather than on every login.
+JWT_EXP_HOURS = _jwt_exp_hours()
+_SESSION_COOKIE_OPTS: Dict[str, Any] = {
+    "httponly": True,
+    "secure": os.getenv("APP_ENV", "").strip().lower() == "production",
+    "samesite": "lax",
+    "max_age": JWT_EXP_HOURS * 3600,
+    "path": "/",
+}
+
+
 def _create_session_jwt(user: Dict[str, Any]) -> str:
     now = datetime.now(timezone.utc)
     payload = {
@@ -85,20 +77,9 @@ def _create_session_jwt(user: Dict[str, Any]) -> str:
         "name": str(user.get("username") or ""),
         "avatar": user.get("avatar"),
         "iat": int(now.timestamp()),
-        "exp": int((now + timedelta(hours=_jwt_exp_hours())).timestamp()),
+        "exp": int((now + timedelta(hours=JWT_EXP_HOURS)).timestamp()),
     }
-    return jwt.encode(payload, _jwt_secret(), algorithm="HS256")
-
-
-def _decode_session_jwt(token: str) -> Dict[str, Any]:
-    try:
-        return jwt.decode(token, _jwt_secret(), algorithms=["HS256"])
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid session")
-
-
-def _session_secure_cookie() -> bool:
-    return os.getenv("APP_ENV", "").strip().lower() == "production"
+    return jwt.encode(payload, session_signing_key(), algorithm="HS256")
 
 
 def _discord_client_id() -> str:
@@ -130,30 +111,33 @@ def _auth_scope() -> str:
     return "identify"
 
 
-def _admin_user_ids() -> set[str]:
-    raw = os.getenv("DEV_USER_IDS", "").strip()
-    if not raw:
-        return set()
-    return {x.strip() for x in raw.split(",") if x.strip()}
-
-
 def _get_current_user(request: Request) -> Dict[str, Any]:
     token = request.cookies.get(JWT_COOKIE_NAME, "")
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    claims = _decode_session_jwt(token)
+    claims = decode_session_jwt(token)
     uid = str(claims.get("sub") or "")
     return {
         "discord_user_id": uid,
         "discord_username": str(claims.get("name") or ""),
         "avatar": claims.get("avatar"),
-        "is_admin": uid in _admin_user_ids(),
+        "is_admin": uid in admin_user_ids(),
     }
 
 
+# uid -> (username, monotonic time of last upsert). /auth/me runs on every page
+# load; re-upserting an unchanged user more than once per window is wasted work.
+APP_USER_TOUCH_SECONDS = max(0, int(os.getenv("APP_USER_TOUCH_SECONDS", "600")))
+_APP_USER_TOUCHED: Dict[str, Tuple[str, float]] = {}
+
+
 def _ensure_app_user(discord_user_id: str, discord_username: str):
-    conn = _connect()
-    try:
+    now = time.monotonic()
+    seen = _APP_USER_TOUCHED.get(discord_user_id)
+    if seen and seen[0] == discord_username and now - seen[1] < APP_USER_TOUCH_SECONDS:
+        return
+
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -168,13 +152,11 @@ def _ensure_app_user(discord_user_id: str, discord_username: str):
                 (discord_user_id, discord_username),
             )
         conn.commit()
-    finally:
-        conn.close()
+    _APP_USER_TOUCHED[discord_user_id] = (discord_username, now)
 
 
 def _load_alliance_context(discord_user_id: str) -> Dict[str, Any]:
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -203,8 +185,6 @@ def _load_alliance_context(discord_user_id: str) -> Dict[str, Any]:
             "memberships": memberships,
             "active_alliance_id": active_id,
         }
-    finally:
-        conn.close()
 
 
 def _get_fernet() -> Fernet:
@@ -230,6 +210,43 @@ def _decrypt_token(enc: str) -> str:
         raise HTTPException(status_code=500, detail="Failed to decrypt KG token")
 
 
+# -------------------------
+# Outbound HTTP (Discord OAuth + KG web service)
+# -------------------------
+_HTTP_CLIENT: Optional[httpx.Client] = None
+_HTTP_CLIENT_LOCK = threading.Lock()
+
+
+def _http_client() -> httpx.Client:
+    """
+    Process-wide keep-alive client, so repeat calls to discord.com and
+    kingdomgame.net reuse connections instead of paying a TLS handshake each.
+    httpx.Client is safe to share across the endpoint worker threads.
+    """
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        with _HTTP_CLIENT_LOCK:
+            if _HTTP_CLIENT is None:
+                _HTTP_CLIENT = httpx.Client(
+                    timeout=30.0,
+                    # Never keep cookies: the client is shared between users.
+                    cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+                    limits=httpx.Limits(
+                        max_connections=int(os.getenv("HTTP_CLIENT_MAX_CONNECTIONS", "64")),
+                        max_keepalive_connections=int(os.getenv("HTTP_CLIENT_MAX_KEEPALIVE", "32")),
+                    ),
+                )
+    return _HTTP_CLIENT
+
+
+def close_http_client():
+    global _HTTP_CLIENT
+    with _HTTP_CLIENT_LOCK:
+        if _HTTP_CLIENT is not None:
+            _HTTP_CLIENT.close()
+            _HTTP_CLIENT = None
+
+
 def _kg_world_id() -> str:
     return os.getenv("KG_WORLD_ID", "1").strip() or "1"
 
@@ -257,7 +274,7 @@ def _parse_kg_resp_json(raw: Dict[str, Any]) -> Dict[str, Any]:
     d = raw.get("d")
     if isinstance(d, str):
         try:
-            parsed = json.loads(d)
+            parsed = orjson.loads(d)
             if isinstance(parsed, dict):
                 return parsed
         except Exception:
@@ -268,27 +285,25 @@ def _parse_kg_resp_json(raw: Dict[str, Any]) -> Dict[str, Any]:
 
 
 def _kg_post_json(url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    with httpx.Client(timeout=30.0) as client:
+    try:
+        r = _http_client().post(url, headers=_kg_headers(), json=payload)
+        r.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        body = ""
         try:
-            r = client.post(url, headers=_kg_headers(), json=payload)
-            r.raise_for_status()
-        except httpx.HTTPStatusError as e:
+            body = (e.response.text or "").strip().replace("\n", " ")[:220]
+        except Exception:
             body = ""
-            try:
-                body = (e.response.text or "").strip().replace("\n", " ")[:220]
-            except Exception:
-                body = ""
-            status = e.response.status_code if e.response is not None else "?"
-            raise RuntimeError(f"HTTP {status} for {url} body={body}")
+        status = e.response.status_code if e.response is not None else "?"
+        raise RuntimeError(f"HTTP {status} for {url} body={body}")
 
-        j = r.json()
-        return _parse_kg_resp_json(j)
+    j = orjson.loads(r.content)
+    return _parse_kg_resp_json(j)
 
 
 def _upsert_user_kg_connection(discord_user_id: str, discord_username: str, account_id: int, kingdom_id: int, token: str):
     token_enc = _encrypt_token(token.strip())
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -312,13 +327,10 @@ def _upsert_user_kg_connection(discord_user_id: str, discord_username: str, acco
                 ),
             )
         conn.commit()
-    finally:
-        conn.close()
 
 
 def _load_user_kg_connection(discord_user_id: str) -> Optional[Dict[str, Any]]:
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -330,8 +342,6 @@ def _load_user_kg_connection(discord_user_id: str) -> Optional[Dict[str, Any]]:
             )
             row = cur.fetchone()
         return row
-    finally:
-        conn.close()
 
 
 def _require_user_kg_connection(discord_user_id: str) -> Dict[str, Any]:
@@ -817,18 +827,26 @@ def _aggregate_effects(settlements: List[Dict[str, Any]]) -> List[Dict[str, Any]
     return out
 
 
+# None of the authorize parameters change at runtime; the URL is built on the
+# first login (so a missing env var still surfaces as a 500) and reused.
+_DISCORD_AUTHORIZE_URL: Optional[str] = None
+
+
 @router.get("/auth/discord/login")
 def auth_discord_login():
-    query = urlencode(
-        {
-            "client_id": _discord_client_id(),
-            "redirect_uri": _discord_redirect_uri(),
-            "response_type": "code",
-            "scope": _auth_scope(),
-            "prompt": "none",
-        }
-    )
-    return RedirectResponse(url=f"{DISCORD_API_BASE}/oauth2/authorize?{query}", status_code=302)
+    global _DISCORD_AUTHORIZE_URL
+    if _DISCORD_AUTHORIZE_URL is None:
+        query = urlencode(
+            {
+                "client_id": _discord_client_id(),
+                "redirect_uri": _discord_redirect_uri(),
+                "response_type": "code",
+                "scope": _auth_scope(),
+                "prompt": "none",
+            }
+        )
+        _DISCORD_AUTHORIZE_URL = f"{DISCORD_API_BASE}/oauth2/authorize?{query}"
+    return RedirectResponse(url=_DISCORD_AUTHORIZE_URL, status_code=302)
 
 
 @router.get("/auth/discord/callback")
@@ -846,17 +864,17 @@ def auth_discord_callback(code: str):
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
 
     try:
-        with httpx.Client(timeout=20.0) as client:
-            tr = client.post(token_url, data=data, headers=headers)
-            tr.raise_for_status()
-            tok = tr.json()
-            access_token = tok.get("access_token")
-            if not access_token:
-                raise HTTPException(status_code=401, detail="Discord login failed (no access token)")
-
-            ur = client.get(me_url, headers={"Authorization": f"Bearer {access_token}"})
-            ur.raise_for_status()
-            user = ur.json()
+        client = _http_client()
+        tr = client.post(token_url, data=data, headers=headers, timeout=20.0)
+        tr.raise_for_status()
+        tok = tr.json()
+        access_token = tok.get("access_token")
+        if not access_token:
+            raise HTTPException(status_code=401, detail="Discord login failed (no access token)")
+
+        ur = client.get(me_url, headers={"Authorization": f"Bearer {access_token}"}, timeout=20.0)
+        ur.raise_for_status()
+        user = ur.json()
     except HTTPException:
         raise
     except Exception as e:
@@ -865,20 +883,13 @@ def auth_discord_callback(code: str):
     jwt_token = _create_session_jwt(user)
     redirect_to = f"{_frontend_url()}/settlements"
     resp = RedirectResponse(url=redirect_to, status_code=302)
-    resp.set_cookie(
-        key=JWT_COOKIE_NAME,
-        value=jwt_token,
-        httponly=True,
-        secure=_session_secure_cookie(),
-        samesite="lax",
-        max_age=_jwt_exp_hours() * 3600,
-        path="/",
-    )
+    resp.set_cookie(key=JWT_COOKIE_NAME, value=jwt_token, **_SESSION_COOKIE_OPTS)
     return resp
 
 
 @router.post("/auth/logout")
-def auth_logout():
+def auth_logout(request: Request):
+    forget_session(request.cookies.get(JWT_COOKIE_NAME, ""))
     resp = RedirectResponse(url=f"{_frontend_url()}/", status_code=302)
     resp.delete_cookie(JWT_COOKIE_NAME, path="/")
     return resp
@@ -890,19 +901,19 @@ def auth_me(request: Request):
     if not token:
         return {"ok": True, "authenticated": False}
     try:
-        claims = _decode_session_jwt(token)
+        claims = decode_session_jwt(token)
         uid = str(claims.get("sub") or "")
         uname = str(claims.get("name") or "")
         _ensure_app_user(uid, uname)
         actx = _load_alliance_context(uid)
-        return {
+        payload = {
             "ok": True,
             "authenticated": True,
             "user": {
                 "discord_user_id": uid,
                 "discord_username": uname,
                 "avatar": claims.get("avatar"),
-                "is_admin": uid in _admin_user_ids(),
+                "is_admin": uid in admin_user_ids(),
                 "active_alliance_id": actx.get("active_alliance_id"),
                 "alliances": [
                     {
@@ -919,10 +930,19 @@ def auth_me(request: Request):
     except HTTPException:
         return {"ok": True, "authenticated": False}
 
+    # The SPA re-asks on every page transition and the answer rarely changes;
+    # tag the body so the browser can revalidate and get an empty 304 back.
+    body = orjson.dumps(payload)
+    etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+    hdrs = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    inm = request.headers.get("if-none-match", "")
+    if inm and any(t.strip().removeprefix("W/") == etag for t in inm.split(",")):
+        return Response(status_code=304, headers=hdrs)
+    return Response(content=body, media_type="application/json", headers=hdrs)
+
 
 @router.get("/api/alliance/me")
-def alliance_me(request: Request):
-    user = _get_current_user(request)
+def alliance_me(user: Dict[str, Any] = Depends(_get_current_user)):
     _ensure_app_user(user["discord_user_id"], user["discord_username"])
     actx = _load_alliance_context(user["discord_user_id"])
     return {
@@ -942,12 +962,10 @@ def alliance_me(request: Request):
 
 
 @router.post("/api/alliance/switch")
-def alliance_switch(body: AllianceSwitchBody, request: Request):
-    user = _get_current_user(request)
+def alliance_switch(body: AllianceSwitchBody, user: Dict[str, Any] = Depends(_get_current_user)):
     _ensure_app_user(user["discord_user_id"], user["discord_username"])
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -975,8 +993,6 @@ def alliance_switch(body: AllianceSwitchBody, request: Request):
                 (user["discord_user_id"], body.alliance_id),
             )
         conn.commit()
-    finally:
-        conn.close()
 
     actx = _load_alliance_context(user["discord_user_id"])
     return {
@@ -986,8 +1002,7 @@ def alliance_switch(body: AllianceSwitchBody, request: Request):
 
 
 @router.get("/api/kg/connection")
-def kg_connection(request: Request):
-    user = _get_current_user(request)
+def kg_connection(user: Dict[str, Any] = Depends(_get_current_user)):
     row = _load_user_kg_connection(user["discord_user_id"])
     if not row:
         return {"ok": True, "connected": False}
@@ -1004,8 +1019,7 @@ def kg_connection(request: Request):
 
 
 @router.post("/api/kg/connect")
-def kg_connect(body: KGConnectBody, request: Request):
-    user = _get_current_user(request)
+def kg_connect(body: KGConnectBody, user: Dict[str, Any] = Depends(_get_current_user)):
     _upsert_user_kg_connection(
         user["discord_user_id"],
         user["discord_username"],
@@ -1018,32 +1032,26 @@ def kg_connect(body: KGConnectBody, request: Request):
 
 
 @router.delete("/api/kg/connection")
-def kg_disconnect(request: Request):
-    user = _get_current_user(request)
-    conn = _connect()
-    try:
+def kg_disconnect(user: Dict[str, Any] = Depends(_get_current_user)):
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "DELETE FROM public.user_kg_connections WHERE discord_user_id = %s",
                 (user["discord_user_id"],),
             )
         conn.commit()
-    finally:
-        conn.close()
     return {"ok": True, "connected": False}
 
 
 @router.get("/api/kg/settlements")
-def kg_settlements(request: Request):
-    user = _get_current_user(request)
+def kg_settlements(user: Dict[str, Any] = Depends(_get_current_user)):
     conn_row = _require_user_kg_connection(user["discord_user_id"])
     settlements = _fetch_settlements_live(conn_row)
     return {"ok": True, "settlements": settlements}
 
 
 @router.get("/api/kg/settlement-effects")
-def kg_settlement_effects(request: Request):
-    user = _get_current_user(request)
+def kg_settlement_effects(user: Dict[str, Any] = Depends(_get_current_user)):
     conn_row = _require_user_kg_connection(user["discord_user_id"])
     settlements = _fetch_settlements_live(conn_row)
     effects = _aggregate_effects(settlements)
@@ -0,0 +1,105 @@
+import os
+import threading
+from typing import Optional
+
+from fastapi import HTTPException
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, ConnectionPool
+
+# Every worker runs the startup DDL (API schema and poller tables); it is
+# serialized on this transaction-level advisory lock.
+SCHEMA_LOCK_KEY = 4242
+
+
+# -------------------------
+# Shared Postgres connection pool
+# -------------------------
+def _get_dsn() -> str:
+    dsn = os.getenv("DATABASE_URL") or os.getenv("POSTGRES_URL") or ""
+    if not dsn:
+        raise HTTPException(status_code=500, detail="DATABASE_URL is not set")
+    return dsn
+
+
+def _prepare_threshold() -> Optional[int]:
+    # psycopg prepares a statement server-side once it has run this many times
+    # on a connection. Set PG_PREPARE_THRESHOLD=none behind a transaction-mode
+    # PgBouncer that cannot keep prepared statements; None disables preparing
+    # on the connection, including execute(..., prepare=True). That flag is
+    # used for statements that run too rarely per connection to reach the
+    # threshold (the nw tick write, the settlement_observations insert).
+    raw = os.getenv("PG_PREPARE_THRESHOLD", "1").strip().lower()
+    if raw in {"", "none", "off"}:
+        return None
+    return max(0, int(raw))
+
+
+_POOL: Optional[ConnectionPool] = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Process-wide connection pool shared by the API routers.
+    `with get_pool().connection() as conn:` commits on clean exit, rolls back
+    on exception and hands the connection back.
+    """
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                _POOL = ConnectionPool(
+                    _get_dsn(),
+                    min_size=int(os.getenv("PG_POOL_MIN", "4")),
+                    max_size=int(os.getenv("PG_POOL_MAX", "32")),
+                    timeout=float(os.getenv("PG_POOL_TIMEOUT_SECONDS", "5")),
+                    kwargs={"row_factory": dict_row, "prepare_threshold": _prepare_threshold()},
+                    check=ConnectionPool.check_connection,
+                    open=True,
+                )
+    return _POOL
+
+
+def close_pool() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.close()
+            _POOL = None
+
+
+# -------------------------
+# Async pool for the async def read endpoints (opened/closed by the app lifespan)
+# -------------------------
+_ASYNC_POOL: Optional[AsyncConnectionPool] = None
+
+
+async def open_async_pool() -> None:
+    global _ASYNC_POOL
+    if _ASYNC_POOL is not None:
+        return
+    pool = AsyncConnectionPool(
+        _get_dsn(),
+        min_size=int(os.getenv("PG_ASYNC_POOL_MIN", "2")),
+        max_size=int(os.getenv("PG_ASYNC_POOL_MAX", "16")),
+        timeout=float(os.getenv("PG_POOL_TIMEOUT_SECONDS", "5")),
+        kwargs={"row_factory": dict_row, "prepare_threshold": _prepare_threshold()},
+        check=AsyncConnectionPool.check_connection,
+        open=False,
+    )
+    await pool.open()
+    _ASYNC_POOL = pool
+
+
+def get_async_pool() -> AsyncConnectionPool:
+    """`async with get_async_pool().connection() as conn:`; same commit/rollback rules as get_pool()."""
+    if _ASYNC_POOL is None:
+        raise HTTPException(status_code=503, detail="Database pool is not open")
+    return _ASYNC_POOL
+
+
+async def close_async_pool() -> None:
+    global _ASYNC_POOL
+    pool, _ASYNC_POOL = _ASYNC_POOL, None
+    if pool is not None:
+        await pool.close()
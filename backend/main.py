@@ -1,41 +1,153 @@
 import os
 import re
 import gzip
+import hashlib
 import json
 import time
+import zlib
 import threading
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from decimal import Decimal
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Annotated, Any, Dict, List, Optional, Tuple
 
-import jwt
+import anyio
+import orjson
 import psycopg
-from psycopg.rows import dict_row
 
-from fastapi import FastAPI, HTTPException, Request
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, PlainTextResponse
+try:
+    # raw_gz is gzip whether the bot wrote the row or the ingest endpoints here
+    # did (_gzip_raw); reads inflate it with ISA-L's SIMD inflate, a drop-in
+    # for zlib and ~3x faster on x86.
+    from isal import isal_zlib as _inflate_zlib
+except ImportError:
+    _inflate_zlib = zlib
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    ORJSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+)
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
 from nw_api import router as nw_router
 from nw_poll import start_nw_poller
 from rankings_poll import start_rankings_poller
-from auth_kg import router as auth_kg_router, ensure_auth_tables
+from auth_kg import router as auth_kg_router, close_http_client, ensure_auth_tables
 from admin_api import router as admin_router, ensure_admin_tables
+from db import SCHEMA_LOCK_KEY, _get_dsn, close_async_pool, close_pool, get_async_pool, get_pool, open_async_pool
+from session import JWT_COOKIE_NAME, admin_user_ids, decode_session_jwt
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
 
-app = FastAPI()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@asynccontextmanager
+async def _lifespan(_app: FastAPI):
+    # Sync endpoints run on anyio worker threads (40 by default). Size them to
+    # one per DB pool connection plus headroom for threads that hold no
+    # connection (static files, streamed response bodies), so requests queue
+    # on the DB pool rather than on the thread limiter.
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    pool_max = int(os.getenv("PG_POOL_MAX", "32"))
+    limiter.total_tokens = max(1, int(os.getenv("API_THREADPOOL_SIZE", str(pool_max + 16))))
+    _startup()
+    await open_async_pool()
+    yield
+    await close_async_pool()
+    _shutdown()
+
+
+# -------------------------
+# CORS
+# -------------------------
+# Same behaviour as CORSMiddleware(allow_origins=["*"], allow_credentials=True,
+# allow_methods=["*"], allow_headers=["*"]), with the fixed header bytes built
+# once instead of per request.
+_CORS_PREFLIGHT_HEADERS = [
+    (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"),
+    (b"access-control-max-age", b"600"),
+    (b"access-control-allow-credentials", b"true"),
+    (b"vary", b"Origin"),
+    (b"content-type", b"text/plain; charset=utf-8"),
+    (b"content-length", b"2"),
+]
+_CORS_REPLACED = {b"access-control-allow-origin", b"access-control-allow-credentials"}
+
+
+class CORSLite:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = None
+        has_cookie = False
+        preflight = False
+        requested_headers = None
+        for k, v in scope["headers"]:
+            if k == b"origin":
+                if origin is None:
+                    origin = v
+            elif k == b"cookie":
+                has_cookie = True
+            elif k == b"access-control-request-method":
+                preflight = True
+            elif k == b"access-control-request-headers":
+                if requested_headers is None:
+                    requested_headers = v
+
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        if preflight and scope["method"] == "OPTIONS":
+            headers = [(b"access-control-allow-origin", origin), *_CORS_PREFLIGHT_HEADERS]
+            if requested_headers is not None:
+                headers.append((b"access-control-allow-headers", requested_headers))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": b"OK"})
+            return
+
+        # Credentialed requests need the origin echoed back rather than "*".
+        allow_origin = origin if has_cookie else b"*"
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                headers = []
+                vary_seen = False
+                for k, v in message.get("headers") or ():
+                    lk = k.lower()
+                    if lk in _CORS_REPLACED:
+                        continue
+                    if has_cookie and lk == b"vary":
+                        v = v + b", Origin"
+                        vary_seen = True
+                    headers.append((k, v))
+                headers.append((b"access-control-allow-origin", allow_origin))
+                headers.append((b"access-control-allow-credentials", b"true"))
+                if has_cookie and not vary_seen:
+                    headers.append((b"vary", b"Origin"))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+
+app = FastAPI(lifespan=_lifespan, default_response_class=ORJSONResponse)
+
+app.add_middleware(CORSLite)
 
 @app.get("/api/routes")
 def list_routes():
@@ -51,16 +163,44 @@ def list_routes():
 # -------------------------
 # Static (SPA + assets)
 # -------------------------
-if (STATIC_DIR / "assets").exists():
+# Set BEHIND_PROXY=1 when a reverse proxy serves static/ itself (/assets directly,
+# `try_files $uri /index.html` for client routes); Python then skips both.
+SERVE_STATIC = os.getenv("BEHIND_PROXY", "").strip().lower() not in {"1", "true", "yes"}
+
+if SERVE_STATIC and (STATIC_DIR / "assets").exists():
     app.mount("/assets", StaticFiles(directory=str(STATIC_DIR / "assets")), name="assets")
 
+# path -> (mtime, size, etag); content hashes are recomputed only when the file changes.
+_STATIC_ETAGS: Dict[str, Tuple[float, int, str]] = {}
+
+
+def _static_etag(path: Path) -> str:
+    st = path.stat()
+    hit = _STATIC_ETAGS.get(str(path))
+    if hit and hit[0] == st.st_mtime and hit[1] == st.st_size:
+        return hit[2]
+    etag = '"' + hashlib.sha256(path.read_bytes()).hexdigest()[:32] + '"'
+    _STATIC_ETAGS[str(path)] = (st.st_mtime, st.st_size, etag)
+    return etag
+
+
+def _static_file_response(request: Request, path: Path, headers: Optional[Dict[str, str]] = None) -> Response:
+    """FileResponse with a content-hash ETag; answers a matching If-None-Match with 304."""
+    etag = _static_etag(path)
+    hdrs = {"ETag": etag, "Cache-Control": "no-cache"}
+    hdrs.update(headers or {})
+    inm = request.headers.get("if-none-match", "")
+    if inm and any(t.strip().removeprefix("W/") == etag for t in inm.split(",")):
+        return Response(status_code=304, headers=hdrs)
+    return FileResponse(str(path), headers=hdrs)
+
 
 @app.get("/")
-def root():
+def root(request: Request):
     index_path = STATIC_DIR / "index.html"
     if not index_path.exists():
         return JSONResponse({"ok": True, "service": "recon-hub", "note": "static index.html not found"})
-    return FileResponse(str(index_path))
+    return _static_file_response(request, index_path)
 
 
 @app.get("/calc")
@@ -69,14 +209,17 @@ def calc_redirect():
 
 
 @app.get("/kg-calc.html")
-def serve_calc():
+def serve_calc(request: Request):
     p = STATIC_DIR / "kg-calc.html"
     if not p.exists():
         raise HTTPException(status_code=404, detail="kg-calc.html not found")
-    return FileResponse(
-        str(p),
+    # Always revalidate (never serve a stale calculator), but let an unchanged
+    # copy come back as a 304 instead of the full page.
+    return _static_file_response(
+        request,
+        p,
         headers={
-            "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
+            "Cache-Control": "no-cache, must-revalidate, max-age=0",
             "Pragma": "no-cache",
             "Expires": "0",
         },
@@ -85,7 +228,7 @@ def serve_calc():
 
 @app.get("/api/status")
 def status():
-    return {"ok": True, "service": "recon-hub", "ts": datetime.utcnow().isoformat() + "Z"}
+    return {"ok": True, "service": "recon-hub", "ts": datetime.now(timezone.utc)}
 
 
 @app.get("/healthz")
@@ -96,62 +239,30 @@ def healthz():
 # -------------------------
 # Postgres helpers
 # -------------------------
-def _get_dsn() -> str:
-    dsn = os.getenv("DATABASE_URL") or os.getenv("POSTGRES_URL") or ""
-    if not dsn:
-        raise HTTPException(status_code=500, detail="DATABASE_URL is not set")
-    return dsn
-
-
-def _connect() -> psycopg.Connection:
-    return psycopg.connect(_get_dsn(), row_factory=dict_row)
-
-
-JWT_COOKIE_NAME = "rh_session"
-
-
-def _jwt_secret() -> str:
-    secret = os.getenv("JWT_SECRET", "").strip()
-    if not secret:
-        raise HTTPException(status_code=500, detail="JWT_SECRET is not set")
-    return secret
-
-
-def _decode_session_jwt(token: str) -> Dict[str, Any]:
-    try:
-        return jwt.decode(token, _jwt_secret(), algorithms=["HS256"])
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid session")
-
-
-def _admin_user_ids() -> set[str]:
-    raw = os.getenv("DEV_USER_IDS", "").strip()
-    if not raw:
-        return set()
-    return {x.strip() for x in raw.split(",") if x.strip()}
-
-
 def _enforce_alliance_scoping() -> bool:
     return (os.getenv("ENFORCE_ALLIANCE_SCOPING", "false").strip().lower() in {"1", "true", "yes", "on"})
 
 
 def _get_scope_from_request(request: Request) -> Optional[Dict[str, Any]]:
+    """
+    Alliance scope for the current session; use via Depends() so FastAPI
+    resolves it once per request.
+    """
     if not _enforce_alliance_scoping():
         return None
 
     token = request.cookies.get(JWT_COOKIE_NAME, "")
     if not token:
         raise HTTPException(status_code=401, detail="Login required")
-    claims = _decode_session_jwt(token)
+    claims = decode_session_jwt(token)
     uid = str(claims.get("sub") or "").strip()
     if not uid:
         raise HTTPException(status_code=401, detail="Invalid session")
 
-    if uid in _admin_user_ids():
+    if uid in admin_user_ids():
         return None
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -178,20 +289,20 @@ def _get_scope_from_request(request: Request) -> Optional[Dict[str, Any]]:
             )
             active_row = cur.fetchone() or {}
 
+        # Names are never empty, so scoped queries can filter with a plain
+        # (indexable) `alliance = ANY(...)` instead of COALESCE(alliance, '').
         names = [str(r.get("name") or "").strip() for r in rows if str(r.get("name") or "").strip()]
         active_name = str(active_row.get("name") or "").strip()
         if active_name and active_name in names:
             names = [active_name]
         return {"discord_user_id": uid, "alliance_names": names}
-    finally:
-        conn.close()
 
 
 def _require_user_id(request: Request) -> str:
     token = request.cookies.get(JWT_COOKIE_NAME, "")
     if not token:
         raise HTTPException(status_code=401, detail="Login required")
-    claims = _decode_session_jwt(token)
+    claims = decode_session_jwt(token)
     uid = str(claims.get("sub") or "").strip()
     if not uid:
         raise HTTPException(status_code=401, detail="Invalid session")
@@ -202,6 +313,10 @@ class RawReportBody(BaseModel):
     raw_text: str = Field(..., min_length=1, max_length=250000)
 
 
+class RawReportsBulkBody(BaseModel):
+    raw_texts: List[Annotated[str, Field(max_length=250000)]] = Field(..., min_length=1, max_length=500)
+
+
 class KnownHitBody(BaseModel):
     target: str = Field(default="", max_length=120)
     rawRatio: float = Field(..., gt=0)
@@ -290,214 +405,292 @@ DEFAULT_ALLIANCES: List[tuple[str, str]] = [
 ]
 
 
-def seed_default_alliances():
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
-            for slug, name in DEFAULT_ALLIANCES:
-                cur.execute(
-                    """
-                    INSERT INTO public.alliances (slug, name, created_at)
-                    VALUES (%s, %s, now())
-                    ON CONFLICT (slug) DO UPDATE
-                    SET name = EXCLUDED.name
-                    """,
-                    (slug, name),
-                )
-        conn.commit()
-    finally:
-        conn.close()
+def seed_default_alliances(cur: Any) -> None:
+    slugs, names = zip(*DEFAULT_ALLIANCES)
+    cur.execute(
+        """
+        INSERT INTO public.alliances (slug, name, created_at)
+        SELECT u.slug, u.name, now()
+        FROM unnest(%s::text[], %s::text[]) AS u(slug, name)
+        ON CONFLICT (slug) DO UPDATE
+        SET name = EXCLUDED.name
+        WHERE public.alliances.name IS DISTINCT FROM EXCLUDED.name
+        """,
+        (list(slugs), list(names)),
+    )
 
 
-def ensure_recon_tables():
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.attack_reports (
-                    id BIGSERIAL PRIMARY KEY,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    observed_at TIMESTAMPTZ,
-                    target_kingdom TEXT NOT NULL,
-                    target_networth BIGINT,
-                    attack_result TEXT,
-                    gains_json JSONB NOT NULL DEFAULT '{}'::jsonb,
-                    casualties_json JSONB NOT NULL DEFAULT '{}'::jsonb,
-                    raw_text TEXT NOT NULL
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.alliances (
-                    id BIGSERIAL PRIMARY KEY,
-                    slug TEXT UNIQUE NOT NULL,
-                    name TEXT UNIQUE NOT NULL,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.app_users (
-                    discord_user_id TEXT PRIMARY KEY,
-                    discord_username TEXT,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.alliance_memberships (
-                    id BIGSERIAL PRIMARY KEY,
-                    alliance_id BIGINT NOT NULL REFERENCES public.alliances(id) ON DELETE CASCADE,
-                    discord_user_id TEXT NOT NULL REFERENCES public.app_users(discord_user_id) ON DELETE CASCADE,
-                    role TEXT NOT NULL DEFAULT 'member',
-                    status TEXT NOT NULL DEFAULT 'active',
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    UNIQUE (alliance_id, discord_user_id)
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.user_active_alliance (
-                    discord_user_id TEXT PRIMARY KEY REFERENCES public.app_users(discord_user_id) ON DELETE CASCADE,
-                    alliance_id BIGINT NOT NULL REFERENCES public.alliances(id) ON DELETE CASCADE,
-                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.settlement_observations (
-                    id BIGSERIAL PRIMARY KEY,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    source_type TEXT NOT NULL,
-                    source_report_id BIGINT,
-                    kingdom TEXT NOT NULL,
-                    settlement_name TEXT NOT NULL,
-                    settlement_level INT,
-                    settlement_tier TEXT,
-                    event_type TEXT NOT NULL,
-                    event_detail TEXT
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE INDEX IF NOT EXISTS settlement_observations_kingdom_idx
-                ON public.settlement_observations (kingdom, created_at DESC);
-                """
-            )
-            cur.execute(
-                """
-                CREATE INDEX IF NOT EXISTS settlement_observations_settlement_idx
-                ON public.settlement_observations (settlement_name, created_at DESC);
-                """
-            )
-            cur.execute(
-                """
-                CREATE UNIQUE INDEX IF NOT EXISTS settlement_observations_source_unique_idx
-                ON public.settlement_observations
-                (source_type, source_report_id, kingdom, settlement_name, COALESCE(settlement_level, -1), event_type)
-                WHERE source_report_id IS NOT NULL;
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.calc_known_hits (
-                    id BIGSERIAL PRIMARY KEY,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    created_by_discord_user_id TEXT,
-                    alliance_scope TEXT,
-                    target TEXT NOT NULL DEFAULT '',
-                    target_norm TEXT NOT NULL DEFAULT '',
-                    raw_ratio DOUBLE PRECISION NOT NULL,
-                    calibrated_ratio DOUBLE PRECISION,
-                    predicted_outcome TEXT,
-                    actual_outcome TEXT NOT NULL,
-                    atk_power DOUBLE PRECISION,
-                    def_dp DOUBLE PRECISION,
-                    land_taken DOUBLE PRECISION,
-                    note TEXT
-                );
-                """
-            )
-            cur.execute(
-                """
-                ALTER TABLE public.calc_known_hits
-                ADD COLUMN IF NOT EXISTS source_attack_report_id BIGINT;
-                """
-            )
-            cur.execute(
-                """
-                CREATE INDEX IF NOT EXISTS calc_known_hits_target_idx
-                ON public.calc_known_hits (target_norm, created_at DESC);
-                """
-            )
-            cur.execute(
-                """
-                CREATE INDEX IF NOT EXISTS calc_known_hits_alliance_idx
-                ON public.calc_known_hits (alliance_scope, created_at DESC);
-                """
-            )
-            cur.execute(
-                """
-                CREATE UNIQUE INDEX IF NOT EXISTS calc_known_hits_source_attack_unique_idx
-                ON public.calc_known_hits (source_attack_report_id)
-                WHERE source_attack_report_id IS NOT NULL;
-                """
-            )
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS public.user_attack_research (
-                    id BIGSERIAL PRIMARY KEY,
-                    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
-                    discord_user_id TEXT NOT NULL REFERENCES public.app_users(discord_user_id) ON DELETE CASCADE,
-                    name TEXT NOT NULL,
-                    affects TEXT NOT NULL DEFAULT 'all',
-                    rate_per_level DOUBLE PRECISION NOT NULL DEFAULT 0,
-                    level INT NOT NULL DEFAULT 0,
-                    ap_up BOOLEAN NOT NULL DEFAULT false,
-                    dp_up BOOLEAN NOT NULL DEFAULT false,
-                    speed_up BOOLEAN NOT NULL DEFAULT false,
-                    casualty_reduction BOOLEAN NOT NULL DEFAULT false,
-                    notes TEXT,
-                    UNIQUE(discord_user_id, name)
-                );
-                """
-            )
-            cur.execute(
-                """
-                CREATE INDEX IF NOT EXISTS user_attack_research_user_idx
-                ON public.user_attack_research (discord_user_id, updated_at DESC);
-                """
-            )
-        conn.commit()
-    finally:
-        conn.close()
+def ensure_recon_tables(cur: Any) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.attack_reports (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            observed_at TIMESTAMPTZ,
+            target_kingdom TEXT NOT NULL,
+            target_networth BIGINT,
+            attack_result TEXT,
+            gains_json JSONB NOT NULL DEFAULT '{}'::jsonb,
+            casualties_json JSONB NOT NULL DEFAULT '{}'::jsonb,
+            raw_text TEXT NOT NULL
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.alliances (
+            id BIGSERIAL PRIMARY KEY,
+            slug TEXT UNIQUE NOT NULL,
+            name TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.app_users (
+            discord_user_id TEXT PRIMARY KEY,
+            discord_username TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.alliance_memberships (
+            id BIGSERIAL PRIMARY KEY,
+            alliance_id BIGINT NOT NULL REFERENCES public.alliances(id) ON DELETE CASCADE,
+            discord_user_id TEXT NOT NULL REFERENCES public.app_users(discord_user_id) ON DELETE CASCADE,
+            role TEXT NOT NULL DEFAULT 'member',
+            status TEXT NOT NULL DEFAULT 'active',
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            UNIQUE (alliance_id, discord_user_id)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.user_active_alliance (
+            discord_user_id TEXT PRIMARY KEY REFERENCES public.app_users(discord_user_id) ON DELETE CASCADE,
+            alliance_id BIGINT NOT NULL REFERENCES public.alliances(id) ON DELETE CASCADE,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.settlement_observations (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            source_type TEXT NOT NULL,
+            source_report_id BIGINT,
+            kingdom TEXT NOT NULL,
+            settlement_name TEXT NOT NULL,
+            settlement_level INT,
+            settlement_tier TEXT,
+            event_type TEXT NOT NULL,
+            event_detail TEXT
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS settlement_observations_kingdom_idx
+        ON public.settlement_observations (kingdom, created_at DESC);
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS settlement_observations_settlement_idx
+        ON public.settlement_observations (settlement_name, created_at DESC);
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS settlement_observations_kingdom_settlement_idx
+        ON public.settlement_observations (kingdom, settlement_name, created_at DESC);
+        """
+    )
+    cur.execute(
+        """
+        DO $$
+        BEGIN
+            IF to_regclass('public.spy_reports') IS NOT NULL THEN
+                CREATE INDEX IF NOT EXISTS spy_reports_alliance_kingdom_idx
+                ON public.spy_reports (alliance, kingdom);
+                ALTER TABLE public.spy_reports ADD COLUMN IF NOT EXISTS parsed_json JSONB;
+                ALTER TABLE public.spy_reports ADD COLUMN IF NOT EXISTS parsed_version INT;
+
+                CREATE MATERIALIZED VIEW IF NOT EXISTS public.spy_kingdom_summary AS
+                SELECT
+                    kingdom,
+                    COALESCE(alliance, '') AS alliance,
+                    COUNT(*)::int AS report_count,
+                    MAX(created_at) AS latest_report_at
+                FROM public.spy_reports
+                GROUP BY kingdom, COALESCE(alliance, '');
+                CREATE UNIQUE INDEX IF NOT EXISTS spy_kingdom_summary_key_idx
+                ON public.spy_kingdom_summary (kingdom, alliance);
+                CREATE INDEX IF NOT EXISTS spy_kingdom_summary_latest_idx
+                ON public.spy_kingdom_summary (latest_report_at DESC);
+            END IF;
+        END
+        $$;
+        """
+    )
+    # Trigram indexes let the '%term%' ILIKE search in /api/kingdoms use an
+    # index. pg_trgm needs CREATE privilege on the database; skip if absent.
+    cur.execute(
+        """
+        DO $$
+        BEGIN
+            BEGIN
+                CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            EXCEPTION WHEN insufficient_privilege THEN
+                RAISE NOTICE 'pg_trgm unavailable; kingdom search stays unindexed';
+            END;
+            IF to_regclass('public.spy_kingdom_summary') IS NOT NULL
+               AND EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX IF NOT EXISTS spy_kingdom_summary_kingdom_trgm_idx
+                ON public.spy_kingdom_summary USING GIN (kingdom gin_trgm_ops);
+                CREATE INDEX IF NOT EXISTS spy_kingdom_summary_alliance_trgm_idx
+                ON public.spy_kingdom_summary USING GIN (alliance gin_trgm_ops);
+            END IF;
+        END
+        $$;
+        """
+    )
+    cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS settlement_observations_source_unique_idx
+        ON public.settlement_observations
+        (source_type, source_report_id, kingdom, settlement_name, COALESCE(settlement_level, -1), event_type)
+        WHERE source_report_id IS NOT NULL;
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.calc_known_hits (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            created_by_discord_user_id TEXT,
+            alliance_scope TEXT,
+            target TEXT NOT NULL DEFAULT '',
+            target_norm TEXT NOT NULL DEFAULT '',
+            raw_ratio DOUBLE PRECISION NOT NULL,
+            calibrated_ratio DOUBLE PRECISION,
+            predicted_outcome TEXT,
+            actual_outcome TEXT NOT NULL,
+            atk_power DOUBLE PRECISION,
+            def_dp DOUBLE PRECISION,
+            land_taken DOUBLE PRECISION,
+            note TEXT
+        );
+        """
+    )
+    cur.execute(
+        """
+        ALTER TABLE public.calc_known_hits
+        ADD COLUMN IF NOT EXISTS source_attack_report_id BIGINT;
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS calc_known_hits_target_idx
+        ON public.calc_known_hits (target_norm, created_at DESC);
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS calc_known_hits_alliance_idx
+        ON public.calc_known_hits (alliance_scope, created_at DESC);
+        """
+    )
+    cur.execute(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS calc_known_hits_source_attack_unique_idx
+        ON public.calc_known_hits (source_attack_report_id)
+        WHERE source_attack_report_id IS NOT NULL;
+        """
+    )
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS public.user_attack_research (
+            id BIGSERIAL PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            discord_user_id TEXT NOT NULL REFERENCES public.app_users(discord_user_id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            affects TEXT NOT NULL DEFAULT 'all',
+            rate_per_level DOUBLE PRECISION NOT NULL DEFAULT 0,
+            level INT NOT NULL DEFAULT 0,
+            ap_up BOOLEAN NOT NULL DEFAULT false,
+            dp_up BOOLEAN NOT NULL DEFAULT false,
+            speed_up BOOLEAN NOT NULL DEFAULT false,
+            casualty_reduction BOOLEAN NOT NULL DEFAULT false,
+            notes TEXT,
+            UNIQUE(discord_user_id, name)
+        );
+        """
+    )
+    cur.execute(
+        """
+        CREATE INDEX IF NOT EXISTS user_attack_research_user_idx
+        ON public.user_attack_research (discord_user_id, updated_at DESC);
+        """
+    )
 
 
 # -------------------------
 # Spy report parsing (raw -> structured)
 # -------------------------
+def _compile_label(label: str) -> "re.Pattern[str]":
+    return re.compile(rf"^\s*{re.escape(label)}\s*:\s*(.+?)\s*$", re.I | re.M)
+
+
+def _compile_header(header: str) -> "re.Pattern[str]":
+    return re.compile(rf"^\s*{re.escape(header)}\s*$", re.I | re.M)
+
+
+# Labels and section headers are a small fixed set; each is compiled on first use.
+_LABEL_RES: Dict[str, "re.Pattern[str]"] = {}
+_HEADER_RES: Dict[str, "re.Pattern[str]"] = {}
+
+
+def _label_re(label: str) -> "re.Pattern[str]":
+    pat = _LABEL_RES.get(label)
+    if pat is None:
+        pat = _LABEL_RES[label] = _compile_label(label)
+    return pat
+
+
+def _header_re(header: str) -> "re.Pattern[str]":
+    pat = _HEADER_RES.get(header)
+    if pat is None:
+        pat = _HEADER_RES[header] = _compile_header(header)
+    return pat
+
+
 def _grab_line(text: str, label: str) -> Optional[str]:
-    m = re.search(rf"^\s*{re.escape(label)}\s*:\s*(.+?)\s*$", text, flags=re.I | re.M)
+    m = _label_re(label).search(text)
     return m.group(1).strip() if m else None
 
 
+_NUM_STRIP = str.maketrans("", "", ", \t\n\r\f\v")
+
+
 def _num(s: Optional[str]) -> Optional[int]:
     if s is None:
         return None
-    s2 = re.sub(r"[,\s]+", "", s.strip())
+    s2 = s.strip().translate(_NUM_STRIP)
     if not s2:
         return None
     try:
+        # Plain digit strings are the common case; skip the float round-trip.
+        if s2.isdecimal():
+            return int(s2)
         return int(float(s2))
     except Exception:
         return None
@@ -515,35 +708,88 @@ def _num_float(s: Optional[str]) -> Optional[float]:
         return None
 
 
-def _section(text: str, header: str, stop_headers: List[str]) -> str:
-    m = re.search(rf"^\s*{re.escape(header)}\s*$", text, flags=re.I | re.M)
+def _header_line(low: str, header_low: str, start: int = 0) -> Optional[Tuple[int, int]]:
+    """(line_start, line_end) of the first line from `start` that is just the header, or None."""
+    n = len(header_low)
+    i = low.find(header_low, start)
+    while i >= 0:
+        ls = low.rfind("\n", 0, i) + 1
+        le = low.find("\n", i + n)
+        if le < 0:
+            le = len(low)
+        if not low[ls:i].strip() and not low[i + n:le].strip():
+            return ls, le
+        i = low.find(header_low, i + 1)
+    return None
+
+
+def _section(text: str, header: str, stop_headers: List[str], low: Optional[str] = None) -> str:
+    # Headers that never occur (most stop headers, most of the time) are
+    # ruled out with a substring check instead of a line-anchored regex scan.
+    if low is None:
+        low = text.lower()
+    header_low = header.lower()
+    if header_low not in low:
+        return ""
+    if len(low) == len(text):
+        # Offsets in the lowered text line up with the original, so the
+        # header lines can be located with plain finds on `low`.
+        hit = _header_line(low, header_low)
+        if hit is None:
+            return ""
+        start = hit[1]
+        end = len(text)
+        for sh in stop_headers:
+            sh_low = sh.lower()
+            if sh_low not in low:
+                continue
+            stop = _header_line(low, sh_low, start)
+            if stop is not None:
+                end = min(end, stop[0])
+        return text[start:end].strip()
+
+    m = _header_re(header).search(text)
     if not m:
         return ""
     start = m.end()
     tail = text[start:]
     end = len(tail)
     for sh in stop_headers:
-        sm = re.search(rf"^\s*{re.escape(sh)}\s*$", tail, flags=re.I | re.M)
+        if sh.lower() not in low:
+            continue
+        sm = _header_re(sh).search(tail)
         if sm:
             end = min(end, sm.start())
     return tail[:end].strip()
 
 
+_RESEARCH_LEVEL_RE = re.compile(r"^(.+?)\s+(?:lv\.?|lvl\.?|level)\s*([0-9]{1,3})\s*$", re.I)
+_RESEARCH_COLON_RE = re.compile(r"^([^:]{2,80}?)\s*:\s*([0-9]{1,3})\s*$", re.I)
+_DP_MARKER = "Approximate defensive power"
+_DP_RE = re.compile(r"Approximate defensive power\*?\s*:\s*([0-9,\.e\+]+)", re.I)
+
+
 def _parse_kv_lines(chunk: str) -> Dict[str, int]:
+    # "Label: 1,234" lines; a plain partition is far cheaper than a regex here.
     out: Dict[str, int] = {}
     for line in chunk.splitlines():
-        m = re.match(r"^\s*([^:]{1,80}?)\s*:\s*([0-9][0-9,\s]*)\s*$", line)
-        if not m:
+        k, sep, v = line.partition(":")
+        if not sep:
             continue
-        k = m.group(1).strip()
-        v = _num(m.group(2))
-        if v is None:
+        k = k.strip()
+        if not k or len(k) > 80:
             continue
-        out[k] = v
+        v = v.strip()
+        if not v or not ("0" <= v[0] <= "9"):
+            continue
+        digits = v.translate(_NUM_STRIP).strip()
+        if not (digits.isascii() and digits.isdigit()):
+            continue
+        out[k] = int(digits)
     return out
 
 
-def _parse_research_levels(text: str) -> Dict[str, int]:
+def _parse_research_levels(text: str, low: Optional[str] = None) -> Dict[str, int]:
     chunk = _section(
         text,
         "The following technology information was also discovered:",
@@ -552,6 +798,7 @@ def _parse_research_levels(text: str) -> Dict[str, int]:
             "Our spies also found the following information about the",
             "The following information was found regarding troop movements",
         ],
+        low,
     )
     if not chunk:
         return {}
@@ -566,9 +813,9 @@ def _parse_research_levels(text: str) -> Dict[str, int]:
         #   Horse Breeding Lv 10
         #   Horse Breeding level 10
         #   Horse Breeding: 10
-        m = re.match(r"^(.+?)\s+(?:lv\.?|lvl\.?|level)\s*([0-9]{1,3})\s*$", line, flags=re.I)
+        m = _RESEARCH_LEVEL_RE.match(line)
         if not m:
-            m = re.match(r"^([^:]{2,80}?)\s*:\s*([0-9]{1,3})\s*$", line, flags=re.I)
+            m = _RESEARCH_COLON_RE.match(line)
         if not m:
             continue
 
@@ -587,19 +834,60 @@ def _parse_research_levels(text: str) -> Dict[str, int]:
     return out
 
 
-def parse_spy_report(text: str) -> Dict[str, Any]:
-    target = _grab_line(text, "Target")
-    alliance = _grab_line(text, "Alliance")
-    honour = _num_float(_grab_line(text, "Honour"))
-    ranking = _num(_grab_line(text, "Ranking"))
-    networth = _num(_grab_line(text, "Networth"))
-    spies_sent = _num(_grab_line(text, "Spies Sent"))
-    spies_lost = _num(_grab_line(text, "Spies Lost"))
-    result_level = _grab_line(text, "Result Level")
-    castles = _num(_grab_line(text, "Number of Castles"))
+_SPY_HEADER_FIELDS = {
+    "target": "target",
+    "alliance": "alliance",
+    "honour": "honour",
+    "ranking": "ranking",
+    "networth": "networth",
+    "spies sent": "spies_sent",
+    "spies lost": "spies_lost",
+    "result level": "result_level",
+    "number of castles": "castles",
+}
+
+
+def _scan_headers(text: str) -> Dict[str, str]:
+    """Single pass over the report for the "Label: value" header fields; first occurrence wins."""
+    out: Dict[str, str] = {}
+    for line in text.split("\n"):
+        k, sep, v = line.partition(":")
+        if not sep:
+            continue
+        field = _SPY_HEADER_FIELDS.get(k.strip().lower())
+        if field is None or field in out:
+            continue
+        v = v.strip()
+        if v:
+            out[field] = v
+        if len(out) == len(_SPY_HEADER_FIELDS):
+            break
+    return out
+
+
+def parse_spy_report(text: str, low: Optional[str] = None) -> Dict[str, Any]:
+    # `low` is text.lower(); callers that already have it pass it in so the
+    # report is lowered once rather than once per section lookup.
+    if low is None:
+        low = text.lower()
+    headers = _scan_headers(text)
+    target = headers.get("target")
+    alliance = headers.get("alliance")
+    honour = _num_float(headers.get("honour"))
+    ranking = _num(headers.get("ranking"))
+    networth = _num(headers.get("networth"))
+    spies_sent = _num(headers.get("spies_sent"))
+    spies_lost = _num(headers.get("spies_lost"))
+    result_level = headers.get("result_level")
+    castles = _num(headers.get("castles"))
 
     defender_dp = None
-    m = re.search(r"Approximate defensive power\*?\s*:\s*([0-9,\.e\+]+)", text, flags=re.I)
+    # Try the usual spelling at its literal offset; the case-insensitive
+    # search only runs when that misses and the phrase is there at all.
+    idx = text.find(_DP_MARKER)
+    m = _DP_RE.match(text, idx) if idx >= 0 else None
+    if m is None and (idx >= 0 or _DP_MARKER.lower() in low):
+        m = _DP_RE.search(text)
     if m:
         try:
             defender_dp = int(float(m.group(1).replace(",", "")))
@@ -610,6 +898,7 @@ def parse_spy_report(text: str) -> Dict[str, Any]:
         text,
         "Our spies also found the following information about the kingdom's resources:",
         ["Our spies also found the following information about the kingdom's troops:"],
+        low,
     )
     troops_chunk = _section(
         text,
@@ -622,21 +911,19 @@ def parse_spy_report(text: str) -> Dict[str, Any]:
             "Our spies also found the following information about the medium town",
             "Our spies also found the following information about the large town",
         ],
+        low,
     )
 
     resources = _parse_kv_lines(resources_chunk)
     troops_raw = _parse_kv_lines(troops_chunk)
 
-    troops: Dict[str, int] = {}
-    for k, v in troops_raw.items():
-        lk = k.lower()
-        if lk.startswith("population"):
-            continue
-        if "defensive power" in lk:
-            continue
-        troops[k] = v
+    troops: Dict[str, int] = {
+        k: v
+        for k, v in troops_raw.items()
+        if not ((lk := k.lower()).startswith("population") or "defensive power" in lk)
+    }
 
-    research_levels = _parse_research_levels(text)
+    research_levels = _parse_research_levels(text, low)
 
     return {
         "target": target,
@@ -655,17 +942,41 @@ def parse_spy_report(text: str) -> Dict[str, Any]:
     }
 
 
+_RECEIVED_LINE_RE = re.compile(r"^\s*Received\s*:\s*(.+?)\s*$", re.I | re.M)
+# Same shapes strptime accepted for "%b %d, %Y, %I:%M:%S %p" / "%B %d, %Y, %I:%M:%S %p".
+_RECEIVED_AT_RE = re.compile(
+    r"([A-Za-z]+)\s+(\d{1,2}),\s+(\d{4}),\s+(\d{1,2}):(\d{1,2}):(\d{1,2})\s+([AP]M)",
+    re.I,
+)
+_MONTH_NAMES = (
+    "january", "february", "march", "april", "may", "june",
+    "july", "august", "september", "october", "november", "december",
+)
+_MONTHS = {name: i for i, name in enumerate(_MONTH_NAMES, start=1)}
+_MONTHS.update({name[:3]: i for i, name in enumerate(_MONTH_NAMES, start=1)})
+
+
 def _parse_received_at(text: str) -> Optional[datetime]:
-    m = re.search(r"^\s*Received\s*:\s*(.+?)\s*$", text, flags=re.I | re.M)
+    m = _RECEIVED_LINE_RE.search(text)
     if not m:
         return None
-    raw = m.group(1).strip()
-    for fmt in ("%b %d, %Y, %I:%M:%S %p", "%B %d, %Y, %I:%M:%S %p"):
-        try:
-            return datetime.strptime(raw, fmt)
-        except Exception:
-            continue
-    return None
+    dm = _RECEIVED_AT_RE.fullmatch(m.group(1).strip())
+    if not dm:
+        return None
+    mon, day, year, hour, minute, sec, ampm = dm.groups()
+    month = _MONTHS.get(mon.lower())
+    hour_i = int(hour)
+    if month is None or not 1 <= hour_i <= 12:
+        return None
+    hour_i = hour_i % 12 + (12 if ampm.upper() == "PM" else 0)
+    try:
+        return datetime(int(year), month, int(day), hour_i, int(minute), int(sec))
+    except ValueError:
+        return None
+
+
+_GAIN_ITEM_RE = re.compile(r"^([0-9][0-9,\s]*)\s+(.+?)$")
+_CASUALTY_ITEM_RE = re.compile(r"^([0-9][0-9,\s]*)\s*/\s*([0-9][0-9,\s]*)\s+(.+?)$")
 
 
 def _parse_gain_list(chunk: str) -> Dict[str, int]:
@@ -674,7 +985,7 @@ def _parse_gain_list(chunk: str) -> Dict[str, int]:
         p = part.strip()
         if not p:
             continue
-        m = re.match(r"^([0-9][0-9,\s]*)\s+(.+?)$", p)
+        m = _GAIN_ITEM_RE.match(p)
         if not m:
             continue
         n = _num(m.group(1))
@@ -690,7 +1001,7 @@ def _parse_casualty_list(chunk: str) -> Dict[str, Dict[str, int]]:
         p = part.strip()
         if not p:
             continue
-        m = re.match(r"^([0-9][0-9,\s]*)\s*/\s*([0-9][0-9,\s]*)\s+(.+?)$", p)
+        m = _CASUALTY_ITEM_RE.match(p)
         if not m:
             continue
         lost = _num(m.group(1))
@@ -702,22 +1013,36 @@ def _parse_casualty_list(chunk: str) -> Dict[str, Dict[str, int]]:
     return out
 
 
+_SETTLEMENT_TIERED_RE = re.compile(
+    r"(?i)the\s+(small|medium|large)\s+(?:town|city)\s+(.+?)\s+\(level\s+(\d+)\s+settlement\)"
+)
+_SETTLEMENT_ABOUT_RE = re.compile(
+    r"(?i)about\s+the\s+(small|medium|large)\s+(?:town|city)\s+(.+?)\s+\(level\s+(\d+)\s+settlement\)"
+)
+_SETTLEMENT_ABOUT_HEADER_RE = re.compile(
+    r"(?i)about\s+the\s+(small|medium|large)\s+(?:town|city)\s+(.+?)\s*:"
+)
+_SETTLEMENT_LEVEL_RE = re.compile(
+    r"(?i)\b(.+?)\s+\(level\s+(\d+)\s+settlement\)"
+)
+
+
 def _parse_settlement_mentions(text: str) -> List[Dict[str, Any]]:
     found: List[Dict[str, Any]] = []
 
-    p1 = re.compile(
-        r"(?i)the\s+(small|medium|large)\s+(?:town|city)\s+(.+?)\s+\(level\s+(\d+)\s+settlement\)"
-    )
-    p1b = re.compile(
-        r"(?i)about\s+the\s+(small|medium|large)\s+(?:town|city)\s+(.+?)\s+\(level\s+(\d+)\s+settlement\)"
-    )
-    p1c = re.compile(
-        r"(?i)about\s+the\s+(small|medium|large)\s+(?:town|city)\s+(.+?)\s*:"
-    )
-    p2 = re.compile(
-        r"(?i)\b(.+?)\s+\(level\s+(\d+)\s+settlement\)"
-    )
-    for m in p1.finditer(text):
+    # Literal pre-filter: most reports mention no settlement at all, and the
+    # substring checks are far cheaper than running every pattern.
+    folded = text.casefold()
+    has_level = "settlement" in folded
+    has_about = "about" in folded and ("town" in folded or "city" in folded)
+    if not has_level and not has_about:
+        return []
+
+    p1 = _SETTLEMENT_TIERED_RE
+    p1b = _SETTLEMENT_ABOUT_RE
+    p1c = _SETTLEMENT_ABOUT_HEADER_RE
+    p2 = _SETTLEMENT_LEVEL_RE
+    for m in (p1.finditer(text) if has_level else ()):
         tier = m.group(1).strip().lower()
         name = m.group(2).strip()
         lvl = _num(m.group(3))
@@ -731,7 +1056,7 @@ def _parse_settlement_mentions(text: str) -> List[Dict[str, Any]]:
             }
         )
 
-    for m in p1b.finditer(text):
+    for m in (p1b.finditer(text) if has_level else ()):
         tier = m.group(1).strip().lower()
         name = m.group(2).strip()
         lvl = _num(m.group(3))
@@ -745,7 +1070,7 @@ def _parse_settlement_mentions(text: str) -> List[Dict[str, Any]]:
             }
         )
 
-    for m in p1c.finditer(text):
+    for m in (p1c.finditer(text) if has_about else ()):
         tier = m.group(1).strip().lower()
         name = m.group(2).strip()
         if not name:
@@ -758,7 +1083,7 @@ def _parse_settlement_mentions(text: str) -> List[Dict[str, Any]]:
             }
         )
 
-    if not found:
+    if not found and has_level:
         for line in text.splitlines():
             if "level" not in line.lower() or "settlement" not in line.lower():
                 continue
@@ -789,37 +1114,38 @@ def _parse_settlement_mentions(text: str) -> List[Dict[str, Any]]:
     return out
 
 
+_ATTACK_TARGET_NW_RE = re.compile(r"^\s*Attack Report:\s*(.+?)\s*\(NW:\s*\+?\s*([0-9,]+)\)\s*$", re.I | re.M)
+_ATTACK_SUBJECT_RE = re.compile(r"^\s*Subject:\s*Attack Report:\s*(.+?)\s*$", re.I | re.M)
+_ATTACK_GAINS_RE = re.compile(r"You have gained the following during the attack:\s*(.+?)\s*$", re.I | re.M)
+_ATTACK_CASUALTIES_RE = re.compile(
+    r"We regret to inform you of the following casualties during the attack:\s*(.+?)\s*$",
+    re.I | re.M,
+)
+
+
 def parse_attack_report(text: str) -> Dict[str, Any]:
     received_at = _parse_received_at(text)
 
     target = None
     target_networth = None
-    m = re.search(r"^\s*Attack Report:\s*(.+?)\s*\(NW:\s*\+?\s*([0-9,]+)\)\s*$", text, flags=re.I | re.M)
+    m = _ATTACK_TARGET_NW_RE.search(text)
     if m:
         target = m.group(1).strip()
         target_networth = _num(m.group(2))
     else:
-        m2 = re.search(r"^\s*Subject:\s*Attack Report:\s*(.+?)\s*$", text, flags=re.I | re.M)
+        m2 = _ATTACK_SUBJECT_RE.search(text)
         if m2:
             target = m2.group(1).strip()
 
     result = _grab_line(text, "Attack Result")
 
     gains: Dict[str, int] = {}
-    gm = re.search(
-        r"You have gained the following during the attack:\s*(.+?)\s*$",
-        text,
-        flags=re.I | re.M,
-    )
+    gm = _ATTACK_GAINS_RE.search(text)
     if gm:
         gains = _parse_gain_list(gm.group(1))
 
     casualties: Dict[str, Dict[str, int]] = {}
-    cm = re.search(
-        r"We regret to inform you of the following casualties during the attack:\s*(.+?)\s*$",
-        text,
-        flags=re.I | re.M,
-    )
+    cm = _ATTACK_CASUALTIES_RE.search(text)
     if cm:
         casualties = _parse_casualty_list(cm.group(1))
 
@@ -1039,8 +1365,8 @@ def _auto_insert_known_hit_for_attack(cur, attack_report_id: int, attack_created
         return False
 
     cur.execute(
-        """
-        SELECT id, created_at, kingdom, alliance, defense_power, castles, raw, raw_gz
+        f"""
+        SELECT id, created_at, kingdom, alliance, defense_power, castles, {RAW_COLUMNS_SQL}
         FROM public.spy_reports
         WHERE kingdom = %s
           AND created_at <= %s
@@ -1103,46 +1429,93 @@ def _auto_insert_known_hit_for_attack(cur, attack_report_id: int, attack_created
     return cur.rowcount > 0
 
 
-def _load_raw_text(row: Dict[str, Any]) -> str:
-    raw = row.get("raw")
-    if raw and isinstance(raw, str) and raw.strip():
+# Only ship the column _load_raw_text will actually use: plain `raw` when it
+# has content, otherwise the compressed `raw_gz`.
+RAW_COLUMNS_SQL = r"CASE WHEN raw ~ '\S' THEN raw END AS raw, CASE WHEN raw ~ '\S' THEN NULL ELSE raw_gz END AS raw_gz"
+
+# parse_spy_report output is cached in spy_reports.parsed_json. Bump this when
+# the parser's output changes so stale rows are re-parsed and rewritten.
+SPY_PARSE_VERSION = 1
+PARSED_OR_RAW_COLUMNS_SQL = (
+    f"CASE WHEN parsed_version = {SPY_PARSE_VERSION} THEN parsed_json END AS parsed_json, "
+    f"CASE WHEN parsed_version IS DISTINCT FROM {SPY_PARSE_VERSION} AND raw ~ '\\S' THEN raw END AS raw, "
+    f"CASE WHEN parsed_version = {SPY_PARSE_VERSION} OR raw ~ '\\S' THEN NULL ELSE raw_gz END AS raw_gz"
+)
+
+RAW_TEXT_CACHE_SIZE = max(0, int(os.getenv("RAW_TEXT_CACHE_SIZE", "256")))
+_raw_text_cache: "OrderedDict[Tuple[int, int], str]" = OrderedDict()
+_raw_text_cache_lock = threading.Lock()
+
+
+def _gunzip(blob: bytes) -> bytes:
+    # One C-level inflate for the usual single-member blob; gzip.decompress
+    # only for the rare multi-member stream.
+    d = _inflate_zlib.decompressobj(wbits=31)
+    out = d.decompress(blob)
+    if d.unused_data:
+        return gzip.decompress(blob)
+    return out
+
+
+def _gzip_raw(raw_text: str) -> bytes:
+    # New reports are stored compressed in raw_gz (raw is left empty), the
+    # same layout _load_raw_text already reads for bot-written rows.
+    return gzip.compress(raw_text.encode("utf-8"), compresslevel=6)
+
+
+def _load_raw_text(row: Dict[str, Any], cache: bool = True) -> str:
+    raw = row.get("raw")
+    if raw and isinstance(raw, str) and raw.strip():
         return raw
 
     raw_gz = row.get("raw_gz")
-    if raw_gz:
-        try:
-            return gzip.decompress(raw_gz).decode("utf-8", errors="replace")
-        except Exception:
-            pass
+    if not raw_gz:
+        return ""
 
-    return ""
+    key = None
+    if cache and RAW_TEXT_CACHE_SIZE and row.get("id") is not None:
+        key = (int(row["id"]), len(raw_gz))
+        with _raw_text_cache_lock:
+            hit = _raw_text_cache.get(key)
+            if hit is not None:
+                _raw_text_cache.move_to_end(key)
+                return hit
+
+    try:
+        text = _gunzip(bytes(raw_gz)).decode("utf-8", errors="replace")
+    except Exception:
+        return ""
+
+    if key is not None:
+        with _raw_text_cache_lock:
+            _raw_text_cache[key] = text
+            if len(_raw_text_cache) > RAW_TEXT_CACHE_SIZE:
+                _raw_text_cache.popitem(last=False)
+    return text
 
 
 # -------------------------
 # API: Kingdom list
 # -------------------------
 @app.get("/api/kingdoms")
-def list_kingdoms(request: Request, search: str = "", limit: int = 500):
+async def list_kingdoms(
+    search: str = "",
+    limit: int = 500,
+    scope: Optional[Dict[str, Any]] = Depends(_get_scope_from_request),
+):
     s = search.strip()
-    scope = _get_scope_from_request(request)
     scoped_alliances = (scope or {}).get("alliance_names") or []
 
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
+    async with get_async_pool().connection() as conn:
+        async with conn.cursor() as cur:
             if s and scoped_alliances:
                 like = f"%{s}%"
-                cur.execute(
+                await cur.execute(
                     """
-                    SELECT
-                        kingdom,
-                        COALESCE(alliance, '') AS alliance,
-                        COUNT(*)::int AS report_count,
-                        MAX(created_at) AS latest_report_at
-                    FROM public.spy_reports
-                    WHERE (kingdom ILIKE %s OR COALESCE(alliance,'') ILIKE %s)
-                      AND COALESCE(alliance,'') = ANY(%s)
-                    GROUP BY kingdom, COALESCE(alliance,'')
+                    SELECT kingdom, alliance, report_count, latest_report_at
+                    FROM public.spy_kingdom_summary
+                    WHERE (kingdom ILIKE %s OR alliance ILIKE %s)
+                      AND alliance = ANY(%s)
                     ORDER BY latest_report_at DESC
                     LIMIT %s
                     """,
@@ -1150,53 +1523,38 @@ def list_kingdoms(request: Request, search: str = "", limit: int = 500):
                 )
             elif s:
                 like = f"%{s}%"
-                cur.execute(
+                await cur.execute(
                     """
-                    SELECT
-                        kingdom,
-                        COALESCE(alliance, '') AS alliance,
-                        COUNT(*)::int AS report_count,
-                        MAX(created_at) AS latest_report_at
-                    FROM public.spy_reports
-                    WHERE kingdom ILIKE %s OR COALESCE(alliance,'') ILIKE %s
-                    GROUP BY kingdom, COALESCE(alliance,'')
+                    SELECT kingdom, alliance, report_count, latest_report_at
+                    FROM public.spy_kingdom_summary
+                    WHERE kingdom ILIKE %s OR alliance ILIKE %s
                     ORDER BY latest_report_at DESC
                     LIMIT %s
                     """,
                     (like, like, limit),
                 )
             elif scoped_alliances:
-                cur.execute(
+                await cur.execute(
                     """
-                    SELECT
-                        kingdom,
-                        COALESCE(alliance, '') AS alliance,
-                        COUNT(*)::int AS report_count,
-                        MAX(created_at) AS latest_report_at
-                    FROM public.spy_reports
-                    WHERE COALESCE(alliance,'') = ANY(%s)
-                    GROUP BY kingdom, COALESCE(alliance,'')
+                    SELECT kingdom, alliance, report_count, latest_report_at
+                    FROM public.spy_kingdom_summary
+                    WHERE alliance = ANY(%s)
                     ORDER BY latest_report_at DESC
                     LIMIT %s
                     """,
                     (scoped_alliances, limit),
                 )
             else:
-                cur.execute(
+                await cur.execute(
                     """
-                    SELECT
-                        kingdom,
-                        COALESCE(alliance, '') AS alliance,
-                        COUNT(*)::int AS report_count,
-                        MAX(created_at) AS latest_report_at
-                    FROM public.spy_reports
-                    GROUP BY kingdom, COALESCE(alliance,'')
+                    SELECT kingdom, alliance, report_count, latest_report_at
+                    FROM public.spy_kingdom_summary
                     ORDER BY latest_report_at DESC
                     LIMIT %s
                     """,
                     (limit,),
                 )
-            rows = cur.fetchall()
+            rows = await cur.fetchall()
 
         out = []
         for r in rows:
@@ -1210,71 +1568,117 @@ def list_kingdoms(request: Request, search: str = "", limit: int = 500):
             )
 
         return {"ok": True, "kingdoms": out}
-    finally:
-        conn.close()
 
 
 # -------------------------
 # API: Spy reports for kingdom
 # -------------------------
-@app.get("/api/kingdoms/{kingdom}/spy-reports")
-def list_spy_reports(request: Request, kingdom: str, limit: int = 50):
-    scope = _get_scope_from_request(request)
-    scoped_alliances = (scope or {}).get("alliance_names") or []
-    conn = _connect()
+SPY_LIST_FETCH_SIZE = 8
+SPY_LIST_MAX_LIMIT = 200
+
+
+def _orjson_default(v: Any) -> Any:
+    # Same as FastAPI's encoder: integral Decimals become ints, the rest floats.
+    if isinstance(v, Decimal):
+        return int(v) if v.as_tuple().exponent >= 0 else float(v)
+    raise TypeError
+
+
+def _store_parsed_spy_reports(conn: Any, rows: List[Tuple[int, str]]) -> None:
+    """Fill parsed_json for reports parsed on read; a failure here must not fail the read."""
     try:
         with conn.cursor() as cur:
-            if scoped_alliances:
-                cur.execute(
-                    """
-                    SELECT id, created_at, kingdom, alliance, defense_power, castles, raw, raw_gz
-                    FROM public.spy_reports
-                    WHERE kingdom = %s
-                      AND COALESCE(alliance,'') = ANY(%s)
-                    ORDER BY created_at DESC, id DESC
-                    LIMIT %s
-                    """,
-                    (kingdom, scoped_alliances, limit),
-                )
-            else:
-                cur.execute(
-                    """
-                    SELECT id, created_at, kingdom, alliance, defense_power, castles, raw, raw_gz
-                    FROM public.spy_reports
-                    WHERE kingdom = %s
-                    ORDER BY created_at DESC, id DESC
-                    LIMIT %s
-                    """,
-                    (kingdom, limit),
-                )
-            rows = cur.fetchall()
-
-        reports = []
-        for r in rows:
-            raw_text = _load_raw_text(r)
-            parsed = parse_spy_report(raw_text) if raw_text else {}
-            reports.append(
-                {
-                    "id": r["id"],
-                    "created_at": r["created_at"],
-                    "kingdom": r["kingdom"],
-                    "alliance": r.get("alliance"),
-                    "defense_power": r.get("defense_power"),
-                    "castles": r.get("castles"),
-                    "parsed": parsed,
-                    "troop_keys": sorted(list((parsed.get("troops") or {}).keys()))[:50],
-                    "resource_keys": sorted(list((parsed.get("resources") or {}).keys()))[:50],
-                    "research_keys": sorted(list((parsed.get("research_levels") or {}).keys()))[:100],
-                }
+            cur.execute(
+                """
+                UPDATE public.spy_reports AS s
+                SET parsed_json = v.parsed, parsed_version = %s
+                FROM unnest(%s::bigint[], %s::jsonb[]) AS v(id, parsed)
+                WHERE s.id = v.id
+                """,
+                (SPY_PARSE_VERSION, [r[0] for r in rows], [r[1] for r in rows]),
             )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[spy-reports] parsed_json backfill failed: {repr(e)}")
 
-        return {"ok": True, "kingdom": kingdom, "reports": reports}
-    finally:
-        conn.close()
+
+@app.get("/api/kingdoms/{kingdom}/spy-reports")
+def list_spy_reports(
+    kingdom: str,
+    limit: int = 50,
+    scope: Optional[Dict[str, Any]] = Depends(_get_scope_from_request),
+):
+    limit = max(1, min(int(limit), SPY_LIST_MAX_LIMIT))
+    scoped_alliances = (scope or {}).get("alliance_names") or []
+    if scoped_alliances:
+        q = f"""
+            SELECT id, created_at, kingdom, alliance, defense_power, castles, {PARSED_OR_RAW_COLUMNS_SQL}
+            FROM public.spy_reports
+            WHERE kingdom = %s
+              AND alliance = ANY(%s)
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """
+        args: tuple = (kingdom, scoped_alliances, limit)
+    else:
+        q = f"""
+            SELECT id, created_at, kingdom, alliance, defense_power, castles, {PARSED_OR_RAW_COLUMNS_SQL}
+            FROM public.spy_reports
+            WHERE kingdom = %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """
+        args = (kingdom, limit)
+
+    # Server-side cursor: only SPY_LIST_FETCH_SIZE raw bodies are in memory at
+    # once; each report is kept only as its serialized bytes (at most
+    # SPY_LIST_MAX_LIMIT of them). The connection goes back to the pool before
+    # the response is sent, so a slow client never holds it.
+    chunks: List[bytes] = [b'{"ok":true,"kingdom":' + orjson.dumps(kingdom) + b',"reports":[']
+    sep = b""
+    with get_pool().connection() as conn:
+        unparsed: List[Tuple[int, str]] = []
+        with conn.cursor(name="spy_report_listing") as cur:
+            cur.execute(q, args)
+            while True:
+                batch = cur.fetchmany(SPY_LIST_FETCH_SIZE)
+                if not batch:
+                    break
+                for r in batch:
+                    parsed = r.get("parsed_json")
+                    if parsed is None:
+                        raw_text = _load_raw_text(r)
+                        parsed = parse_spy_report(raw_text) if raw_text else {}
+                        if raw_text:
+                            unparsed.append((int(r["id"]), orjson.dumps(parsed).decode()))
+                    report = {
+                        "id": r["id"],
+                        "created_at": r["created_at"],
+                        "kingdom": r["kingdom"],
+                        "alliance": r.get("alliance"),
+                        "defense_power": r.get("defense_power"),
+                        "castles": r.get("castles"),
+                        "parsed": parsed,
+                        "troop_keys": sorted(parsed.get("troops") or ())[:50],
+                        "resource_keys": sorted(parsed.get("resources") or ())[:50],
+                        "research_keys": sorted(parsed.get("research_levels") or ())[:100],
+                    }
+                    chunks.append(sep + orjson.dumps(report, default=_orjson_default))
+                    sep = b","
+
+        if unparsed:
+            _store_parsed_spy_reports(conn, unparsed)
+    chunks.append(b"]}")
+
+    return Response(content=b"".join(chunks), media_type="application/json")
+
+
+_WS_RUN_RE = re.compile(r"\s+")
 
 
 def _target_norm(v: Optional[str]) -> str:
-    return re.sub(r"\s+", " ", str(v or "").strip().lower())
+    return _WS_RUN_RE.sub(" ", str(v or "").strip().lower())
 
 
 def _known_hit_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
@@ -1299,8 +1703,7 @@ def _known_hit_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
 
 @app.get("/api/calc/known-hits")
 def list_known_hits(request: Request, limit: int = 1000, target: Optional[str] = None):
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         where = ""
         args: List[Any] = []
         if target and target.strip():
@@ -1321,17 +1724,13 @@ def list_known_hits(request: Request, limit: int = 1000, target: Optional[str] =
             cur.execute(q, tuple(args))
             rows = cur.fetchall()
         return {"ok": True, "hits": [_known_hit_to_api(r) for r in rows]}
-    finally:
-        conn.close()
 
 
 @app.post("/api/calc/known-hits")
-def create_known_hit(request: Request, body: KnownHitBody):
-    uid = _require_user_id(request)
+def create_known_hit(body: KnownHitBody, uid: str = Depends(_require_user_id)):
     target = str(body.target or "").strip()
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -1361,17 +1760,13 @@ def create_known_hit(request: Request, body: KnownHitBody):
             row = cur.fetchone()
         conn.commit()
         return {"ok": True, "hit": _known_hit_to_api(row or {})}
-    finally:
-        conn.close()
 
 
 @app.put("/api/calc/known-hits/{hit_id}")
-def update_known_hit(request: Request, hit_id: int, body: KnownHitBody):
-    _require_user_id(request)
+def update_known_hit(hit_id: int, body: KnownHitBody, uid: str = Depends(_require_user_id)):
     target = str(body.target or "").strip()
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 f"""
@@ -1411,15 +1806,11 @@ def update_known_hit(request: Request, hit_id: int, body: KnownHitBody):
             raise HTTPException(status_code=404, detail="Known hit not found")
         conn.commit()
         return {"ok": True, "hit": _known_hit_to_api(row)}
-    finally:
-        conn.close()
 
 
 @app.delete("/api/calc/known-hits/{hit_id}")
-def delete_known_hit(request: Request, hit_id: int):
-    _require_user_id(request)
-    conn = _connect()
-    try:
+def delete_known_hit(hit_id: int, uid: str = Depends(_require_user_id)):
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "DELETE FROM public.calc_known_hits WHERE id = %s",
@@ -1428,80 +1819,112 @@ def delete_known_hit(request: Request, hit_id: int):
             deleted = cur.rowcount
         conn.commit()
         return {"ok": True, "deleted": int(deleted or 0)}
-    finally:
-        conn.close()
 
 
 @app.delete("/api/calc/known-hits")
-def clear_known_hits(request: Request):
-    _require_user_id(request)
-    conn = _connect()
-    try:
+def clear_known_hits(uid: str = Depends(_require_user_id)):
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM public.calc_known_hits")
             deleted = cur.rowcount
         conn.commit()
         return {"ok": True, "deleted": int(deleted or 0)}
-    finally:
-        conn.close()
 
 
 # -------------------------
 # API: Raw report
 # -------------------------
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """True if Accept-Encoding allows gzip with q > 0 (explicitly or via '*')."""
+    star = False
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip()
+        q = 1.0
+        for param in params.split(";"):
+            k, _, v = param.partition("=")
+            if k.strip() == "q":
+                try:
+                    q = float(v.strip())
+                except ValueError:
+                    q = 0.0
+        if coding in ("gzip", "x-gzip"):
+            return q > 0
+        if coding == "*":
+            star = q > 0
+    return star
+
+
 @app.get("/api/spy-reports/{report_id}/raw", response_class=PlainTextResponse)
-def get_spy_report_raw(request: Request, report_id: int):
-    scope = _get_scope_from_request(request)
+def get_spy_report_raw(
+    report_id: int,
+    request: Request,
+    scope: Optional[Dict[str, Any]] = Depends(_get_scope_from_request),
+):
     scoped_alliances = (scope or {}).get("alliance_names") or []
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             if scoped_alliances:
                 cur.execute(
-                    """
-                    SELECT raw, raw_gz
+                    f"""
+                    SELECT {RAW_COLUMNS_SQL}
                     FROM public.spy_reports
                     WHERE id = %s
-                      AND COALESCE(alliance,'') = ANY(%s)
+                      AND alliance = ANY(%s)
                     """,
                     (report_id, scoped_alliances),
                 )
             else:
-                cur.execute("SELECT raw, raw_gz FROM public.spy_reports WHERE id = %s", (report_id,))
+                cur.execute(f"SELECT {RAW_COLUMNS_SQL} FROM public.spy_reports WHERE id = %s", (report_id,))
             row = cur.fetchone()
         if not row:
             raise HTTPException(status_code=404, detail="Raw report not found")
 
+        # Compressed rows go out as stored when the client takes gzip.
+        raw_gz = row.get("raw_gz")
+        if raw_gz and _accepts_gzip(request.headers.get("accept-encoding", "")):
+            return Response(
+                content=bytes(raw_gz),
+                media_type="text/plain; charset=utf-8",
+                headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+            )
+
         raw_text = _load_raw_text(row)
         if not raw_text:
             raise HTTPException(status_code=404, detail="Raw report not found")
 
         return raw_text
-    finally:
-        conn.close()
 
 
 @app.get("/api/spy-reports/{report_id}")
-def get_spy_report(request: Request, report_id: int):
-    scope = _get_scope_from_request(request)
+def get_spy_report(
+    report_id: int,
+    include_raw: bool = True,
+    scope: Optional[Dict[str, Any]] = Depends(_get_scope_from_request),
+):
     scoped_alliances = (scope or {}).get("alliance_names") or []
-    conn = _connect()
-    try:
+    # The cached parse comes along either way; raw is only shipped when the
+    # caller wants it back (or the cache is stale and it must be re-parsed).
+    if include_raw:
+        cols = f"{RAW_COLUMNS_SQL}, CASE WHEN parsed_version = {SPY_PARSE_VERSION} THEN parsed_json END AS parsed_json"
+    else:
+        cols = PARSED_OR_RAW_COLUMNS_SQL
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             if scoped_alliances:
                 cur.execute(
-                    """
-                    SELECT id, created_at, kingdom, alliance, defense_power, castles, raw, raw_gz
+                    f"""
+                    SELECT id, created_at, kingdom, alliance, defense_power, castles, {cols}
                     FROM public.spy_reports
                     WHERE id = %s
-                      AND COALESCE(alliance,'') = ANY(%s)
+                      AND alliance = ANY(%s)
                     """,
                     (report_id, scoped_alliances),
                 )
             else:
                 cur.execute(
-                    """
-                    SELECT id, created_at, kingdom, alliance, defense_power, castles, raw, raw_gz
+                    f"""
+                    SELECT id, created_at, kingdom, alliance, defense_power, castles, {cols}
                     FROM public.spy_reports
                     WHERE id = %s
                     """,
@@ -1512,68 +1935,140 @@ def get_spy_report(request: Request, report_id: int):
             raise HTTPException(status_code=404, detail="Report not found")
 
         raw_text = _load_raw_text(row)
-        parsed = parse_spy_report(raw_text) if raw_text else {}
-        return {
-            "ok": True,
-            "report": {
-                "id": row["id"],
-                "created_at": row["created_at"],
-                "kingdom": row["kingdom"],
-                "alliance": row.get("alliance"),
-                "defense_power": row.get("defense_power"),
-                "castles": row.get("castles"),
-                "parsed": parsed,
-                "raw_text": raw_text,
-            },
+        parsed = row.get("parsed_json")
+        if parsed is None:
+            parsed = parse_spy_report(raw_text) if raw_text else {}
+            if raw_text:
+                _store_parsed_spy_reports(conn, [(int(row["id"]), json.dumps(parsed))])
+        report = {
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "kingdom": row["kingdom"],
+            "alliance": row.get("alliance"),
+            "defense_power": row.get("defense_power"),
+            "castles": row.get("castles"),
+            "parsed": parsed,
         }
-    finally:
-        conn.close()
+        if include_raw:
+            report["raw_text"] = raw_text
+        return {"ok": True, "report": report}
+
 
+# (source_type, source_report_id, kingdom, settlement_name, settlement_level,
+#  settlement_tier, event_type, event_detail)
+SettlementObservation = Tuple[str, Optional[int], str, str, Optional[int], Optional[str], str, Optional[str]]
 
-def _insert_settlement_observation(
-    cur,
+SETTLEMENT_OBS_FLUSH_SIZE = 500
+SYNC_FETCH_SIZE = 1000
+SETTLEMENT_SYNC_WORKERS = max(1, int(os.getenv("SETTLEMENT_SYNC_WORKERS", str(min(8, os.cpu_count() or 1)))))
+
+
+def _settlement_observation_rows(
     *,
     source_type: str,
     source_report_id: Optional[int],
     kingdom: str,
-    settlement_name: str,
-    settlement_level: Optional[int],
-    settlement_tier: Optional[str],
+    mentions: List[Dict[str, Any]],
     event_type: str,
     event_detail: Optional[str],
-)-> bool:
-    cur.execute(
-        """
-        INSERT INTO public.settlement_observations
-          (source_type, source_report_id, kingdom, settlement_name, settlement_level, settlement_tier, event_type, event_detail, created_at)
-        VALUES
-          (%s, %s, %s, %s, %s, %s, %s, %s, now())
-        ON CONFLICT DO NOTHING
-        """,
+) -> List[SettlementObservation]:
+    return [
         (
             source_type,
             source_report_id,
             kingdom,
-            settlement_name,
-            settlement_level,
-            settlement_tier,
+            str(m.get("settlement_name") or "").strip(),
+            m.get("settlement_level"),
+            m.get("settlement_tier"),
             event_type,
             event_detail,
-        ),
+        )
+        for m in mentions
+    ]
+
+
+def _execute_settlement_observations_bulk(cur, rows: List[SettlementObservation]):
+    """
+    Insert many observations in one statement; duplicates are skipped by the
+    unique index, so cur.rowcount is the number actually inserted.
+    """
+    cols = list(zip(*rows))
+    cur.execute(
+        """
+        INSERT INTO public.settlement_observations
+          (source_type, source_report_id, kingdom, settlement_name, settlement_level, settlement_tier, event_type, event_detail, created_at)
+        SELECT u.source_type, u.source_report_id, u.kingdom, u.settlement_name, u.settlement_level,
+               u.settlement_tier, u.event_type, u.event_detail, now()
+        FROM unnest(
+            %s::text[], %s::bigint[], %s::text[], %s::text[], %s::int[], %s::text[], %s::text[], %s::text[]
+        ) AS u(source_type, source_report_id, kingdom, settlement_name, settlement_level, settlement_tier, event_type, event_detail)
+        ON CONFLICT DO NOTHING
+        """,
+        tuple(list(c) for c in cols),
+        prepare=True,
     )
-    return cur.rowcount > 0
+
+
+def _mention_arrays(mentions: List[Dict[str, Any]]) -> Tuple[List[str], List[Optional[int]], List[Optional[str]]]:
+    """
+    Split parsed mentions into parallel name/level/tier arrays for unnest().
+    """
+    names = [str(m.get("settlement_name") or "").strip() for m in mentions]
+    levels = [m.get("settlement_level") for m in mentions]
+    tiers = [m.get("settlement_tier") for m in mentions]
+    return names, levels, tiers
+
+
+def _pipelined_settlement_writer(conn):
+    """
+    Queue bulk observation inserts on a pipelined connection without waiting
+    for each result. Call inside `with conn.pipeline()` and read
+    `inserted()` after the pipeline has synced.
+    """
+    cursors = []
+
+    def flush(rows: List[SettlementObservation]):
+        if not rows:
+            return
+        wcur = conn.cursor()
+        _execute_settlement_observations_bulk(wcur, rows)
+        cursors.append(wcur)
+
+    def inserted() -> int:
+        return sum(max(0, c.rowcount) for c in cursors)
+
+    return flush, inserted
+
+
+def _spy_row_settlement_mentions(r: Dict[str, Any]) -> Tuple[int, str, List[Dict[str, Any]]]:
+    rid = int(r.get("id"))
+    kingdom = str(r.get("kingdom") or "").strip()
+    if not kingdom:
+        return (rid, kingdom, [])
+    raw_text = _load_raw_text(r, cache=False)
+    if not raw_text:
+        return (rid, kingdom, [])
+    return (rid, kingdom, _parse_settlement_mentions(raw_text))
 
 
 def _sync_settlement_observations_from_spy_reports(from_id: int, limit: int) -> Dict[str, int]:
     start_id = max(0, int(from_id))
     lim = max(1, min(int(limit), 1_000_000))
 
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
+    scanned = 0
+    reports_with_settlements = 0
+    last_id = start_id
+    pending: List[SettlementObservation] = []
+
+    # Read through a server-side cursor on one connection while the inserts
+    # are pipelined on another, so only SYNC_FETCH_SIZE rows are held at once.
+    with get_pool().connection() as rconn, get_pool().connection() as conn:
+        flush, inserted = _pipelined_settlement_writer(conn)
+        with rconn.cursor(name="spy_settlement_sync") as cur, conn.pipeline() as p:
+            cur.itersize = SYNC_FETCH_SIZE
             cur.execute(
-                """
-                SELECT id, kingdom, raw, raw_gz
+                f"""
+                SELECT id, kingdom, {RAW_COLUMNS_SQL}
                 FROM public.spy_reports
                 WHERE id > %s
                 ORDER BY id ASC
@@ -1581,63 +2076,61 @@ def _sync_settlement_observations_from_spy_reports(from_id: int, limit: int) ->
                 """,
                 (start_id, lim),
             )
-            rows = cur.fetchall()
-
-            scanned = 0
-            reports_with_settlements = 0
-            inserted_events = 0
-            last_id = start_id
-
-            for r in rows:
-                scanned += 1
-                rid = int(r.get("id"))
-                last_id = max(last_id, rid)
-                kingdom = str(r.get("kingdom") or "").strip()
-                if not kingdom:
-                    continue
-
-                raw_text = _load_raw_text(r)
-                if not raw_text:
-                    continue
-
-                mentions = _parse_settlement_mentions(raw_text)
-                if not mentions:
-                    continue
-
-                reports_with_settlements += 1
-                for s in mentions:
-                    inserted = _insert_settlement_observation(
-                        cur,
-                        source_type="spy",
-                        source_report_id=rid,
-                        kingdom=kingdom,
-                        settlement_name=str(s.get("settlement_name") or "").strip(),
-                        settlement_level=s.get("settlement_level"),
-                        settlement_tier=s.get("settlement_tier"),
-                        event_type="seen",
-                        event_detail=None,
-                    )
-                    if inserted:
-                        inserted_events += 1
+            with ThreadPoolExecutor(max_workers=SETTLEMENT_SYNC_WORKERS) as ex:
+                while True:
+                    batch = cur.fetchmany(SYNC_FETCH_SIZE)
+                    if not batch:
+                        break
+                    # Decompress + parse fan out to the workers; this thread
+                    # stays the single writer and keeps results in id order.
+                    for rid, kingdom, mentions in ex.map(_spy_row_settlement_mentions, batch):
+                        scanned += 1
+                        last_id = max(last_id, rid)
+                        if not mentions:
+                            continue
+
+                        reports_with_settlements += 1
+                        pending.extend(
+                            _settlement_observation_rows(
+                                source_type="spy",
+                                source_report_id=rid,
+                                kingdom=kingdom,
+                                mentions=mentions,
+                                event_type="seen",
+                                event_detail=None,
+                            )
+                        )
+                        if len(pending) >= SETTLEMENT_OBS_FLUSH_SIZE:
+                            flush(pending)
+                            pending = []
+
+            flush(pending)
+            p.sync()
 
         conn.commit()
         return {
             "scanned": scanned,
             "reports_with_settlements": reports_with_settlements,
-            "inserted_events": inserted_events,
+            "inserted_events": inserted(),
             "last_id": last_id,
         }
-    finally:
-        conn.close()
 
 
 def _sync_settlement_observations_from_attack_reports(from_id: int, limit: int) -> Dict[str, int]:
     start_id = max(0, int(from_id))
     lim = max(1, min(int(limit), 1_000_000))
 
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
+    scanned = 0
+    reports_with_settlements = 0
+    last_id = start_id
+    pending: List[SettlementObservation] = []
+
+    # Read through a server-side cursor on one connection while the inserts
+    # are pipelined on another, so only SYNC_FETCH_SIZE rows are held at once.
+    with get_pool().connection() as rconn, get_pool().connection() as conn:
+        flush, inserted = _pipelined_settlement_writer(conn)
+        with rconn.cursor(name="attack_settlement_sync") as cur, conn.pipeline() as p:
+            cur.itersize = SYNC_FETCH_SIZE
             cur.execute(
                 """
                 SELECT id, target_kingdom, raw_text, attack_result
@@ -1648,14 +2141,7 @@ def _sync_settlement_observations_from_attack_reports(from_id: int, limit: int)
                 """,
                 (start_id, lim),
             )
-            rows = cur.fetchall()
-
-            scanned = 0
-            reports_with_settlements = 0
-            inserted_events = 0
-            last_id = start_id
-
-            for r in rows:
+            for r in cur:
                 scanned += 1
                 rid = int(r.get("id"))
                 last_id = max(last_id, rid)
@@ -1673,30 +2159,30 @@ def _sync_settlement_observations_from_attack_reports(from_id: int, limit: int)
                     continue
 
                 reports_with_settlements += 1
-                for s in mentions:
-                    inserted = _insert_settlement_observation(
-                        cur,
+                pending.extend(
+                    _settlement_observation_rows(
                         source_type="attack",
                         source_report_id=rid,
                         kingdom=kingdom,
-                        settlement_name=str(s.get("settlement_name") or "").strip(),
-                        settlement_level=s.get("settlement_level"),
-                        settlement_tier=s.get("settlement_tier"),
+                        mentions=mentions,
                         event_type=str(parsed.get("settlement_event_type") or "seen"),
                         event_detail=parsed.get("settlement_event_detail"),
                     )
-                    if inserted:
-                        inserted_events += 1
+                )
+                if len(pending) >= SETTLEMENT_OBS_FLUSH_SIZE:
+                    flush(pending)
+                    pending = []
+
+            flush(pending)
+            p.sync()
 
         conn.commit()
         return {
             "scanned": scanned,
             "reports_with_settlements": reports_with_settlements,
-            "inserted_events": inserted_events,
+            "inserted_events": inserted(),
             "last_id": last_id,
         }
-    finally:
-        conn.close()
 
 
 def _research_row_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
@@ -1716,10 +2202,8 @@ def _research_row_to_api(row: Dict[str, Any]) -> Dict[str, Any]:
 
 
 @app.get("/api/profile/research")
-def list_my_research(request: Request):
-    uid = _require_user_id(request)
-    conn = _connect()
-    try:
+def list_my_research(uid: str = Depends(_require_user_id)):
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -1732,18 +2216,14 @@ def list_my_research(request: Request):
             )
             rows = cur.fetchall()
         return {"ok": True, "items": [_research_row_to_api(r) for r in rows]}
-    finally:
-        conn.close()
 
 
 @app.post("/api/profile/research")
-def upsert_my_research(request: Request, body: UserResearchBody):
-    uid = _require_user_id(request)
+def upsert_my_research(body: UserResearchBody, uid: str = Depends(_require_user_id)):
     name = str(body.name or "").strip()
     if not name:
         raise HTTPException(status_code=400, detail="name is required")
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -1780,15 +2260,11 @@ def upsert_my_research(request: Request, body: UserResearchBody):
             row = cur.fetchone()
         conn.commit()
         return {"ok": True, "item": _research_row_to_api(row or {})}
-    finally:
-        conn.close()
 
 
 @app.delete("/api/profile/research/{item_id}")
-def delete_my_research(request: Request, item_id: int):
-    uid = _require_user_id(request)
-    conn = _connect()
-    try:
+def delete_my_research(item_id: int, uid: str = Depends(_require_user_id)):
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "DELETE FROM public.user_attack_research WHERE id = %s AND discord_user_id = %s",
@@ -1797,15 +2273,12 @@ def delete_my_research(request: Request, item_id: int):
             deleted = cur.rowcount
         conn.commit()
         return {"ok": True, "deleted": int(deleted or 0)}
-    finally:
-        conn.close()
 
 
 def _sync_auto_known_hits_from_attack_reports(from_id: int, limit: int) -> Dict[str, int]:
     start_id = max(0, int(from_id))
     lim = max(1, min(int(limit), 1_000_000))
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -1848,13 +2321,10 @@ def _sync_auto_known_hits_from_attack_reports(from_id: int, limit: int) -> Dict[
             "inserted_known_hits": inserted_known_hits,
             "last_id": last_id,
         }
-    finally:
-        conn.close()
 
 
 def _initial_settlement_observer_last_id() -> int:
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -1872,12 +2342,20 @@ def _initial_settlement_observer_last_id() -> int:
             cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM public.spy_reports")
             row2 = cur.fetchone() or {}
             return int(row2.get("max_id") or 0)
-    finally:
-        conn.close()
 
 
 _settlement_observer_started = False
 
+# Announced by the spy report ingest endpoints on commit so the settlement
+# observer and the kingdom summary refresher wake without polling.
+SPY_REPORT_CHANNEL = "spy_report_ingested"
+
+
+def _listen_spy_reports() -> psycopg.Connection:
+    conn = psycopg.connect(_get_dsn(), autocommit=True)
+    conn.execute(f"LISTEN {SPY_REPORT_CHANNEL}")
+    return conn
+
 
 def start_settlement_observer():
     global _settlement_observer_started
@@ -1890,28 +2368,154 @@ def start_settlement_observer():
     state = {"last_id": _initial_settlement_observer_last_id()}
 
     def _loop():
+        listener: Optional[psycopg.Connection] = None
         while True:
+            try:
+                if listener is None or listener.closed:
+                    listener = _listen_spy_reports()
+            except Exception as e:
+                print(f"[settlement-observer] listen error: {repr(e)}")
+                listener = None
+
             try:
                 r = _sync_settlement_observations_from_spy_reports(state["last_id"], batch_size)
                 state["last_id"] = max(state["last_id"], int(r.get("last_id") or state["last_id"]))
             except Exception as e:
                 print(f"[settlement-observer] error: {repr(e)}")
-            time.sleep(poll_seconds)
+
+            if listener is None:
+                time.sleep(poll_seconds)
+                continue
+            # Reports written straight to spy_reports by the bot don't notify,
+            # so poll_seconds stays as the fallback wake-up.
+            try:
+                for _ in listener.notifies(timeout=poll_seconds, stop_after=1):
+                    pass
+                # Coalesce a burst of ingests into one sync.
+                for _ in listener.notifies(timeout=0.2):
+                    pass
+            except Exception as e:
+                print(f"[settlement-observer] listen error: {repr(e)}")
+                listener.close()
+                listener = None
+                time.sleep(poll_seconds)
 
     t = threading.Thread(target=_loop, daemon=True, name="settlement-observer")
     t.start()
 
 
+_kingdom_summary_refresher_started = False
+
+# Every worker runs a refresher; only the one holding this lock refreshes.
+KINGDOM_SUMMARY_LOCK_KEY = 4243
+
+
+def _spy_reports_change_count(cur: Any) -> Optional[int]:
+    # Cumulative insert/update/delete counter for spy_reports; catches bot
+    # writes that never NOTIFY. Cheap, unlike count(*) over the table.
+    cur.execute(
+        """
+        SELECT n_tup_ins + n_tup_upd + n_tup_del AS changes
+        FROM pg_stat_user_tables
+        WHERE relid = 'public.spy_reports'::regclass
+        """
+    )
+    row = cur.fetchone()
+    return int(row["changes"]) if row else None
+
+
+def start_kingdom_summary_refresher():
+    """
+    Keeps public.spy_kingdom_summary (behind /api/kingdoms) current. Ingests
+    wake it through SPY_REPORT_CHANNEL and a burst is debounced into one
+    refresh; every KINGDOM_SUMMARY_REFRESH_SECONDS it also refreshes if the
+    spy_reports change counters moved (bot writes, updates, deletes).
+    """
+    global _kingdom_summary_refresher_started
+    if _kingdom_summary_refresher_started:
+        return
+    _kingdom_summary_refresher_started = True
+
+    refresh_seconds = max(5, int(os.getenv("KINGDOM_SUMMARY_REFRESH_SECONDS", "30")))
+    debounce_seconds = max(0.0, float(os.getenv("KINGDOM_SUMMARY_DEBOUNCE_SECONDS", "1")))
+    state: Dict[str, Optional[int]] = {"changes": None}
+
+    def _refresh(notified: bool) -> None:
+        with get_pool().connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (KINGDOM_SUMMARY_LOCK_KEY,))
+                if not cur.fetchone()["locked"]:
+                    conn.rollback()
+                    return
+                changes = _spy_reports_change_count(cur)
+                # Counters lag commits slightly, so a NOTIFY always refreshes.
+                if notified or changes is None or changes != state["changes"]:
+                    cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY public.spy_kingdom_summary")
+            conn.commit()
+        state["changes"] = changes
+
+    def _loop():
+        listener: Optional[psycopg.Connection] = None
+        while True:
+            try:
+                if listener is None or listener.closed:
+                    listener = _listen_spy_reports()
+            except Exception as e:
+                print(f"[kingdom-summary] listen error: {repr(e)}")
+                listener = None
+
+            notified = False
+            if listener is None:
+                time.sleep(refresh_seconds)
+            else:
+                try:
+                    for _ in listener.notifies(timeout=refresh_seconds, stop_after=1):
+                        notified = True
+                    if notified and debounce_seconds > 0:
+                        # Coalesce a burst of ingests into one refresh.
+                        for _ in listener.notifies(timeout=debounce_seconds):
+                            pass
+                except Exception as e:
+                    print(f"[kingdom-summary] listen error: {repr(e)}")
+                    listener.close()
+                    listener = None
+                    time.sleep(refresh_seconds)
+
+            try:
+                _refresh(notified)
+            except Exception as e:
+                print(f"[kingdom-summary] refresh error: {repr(e)}")
+
+    t = threading.Thread(target=_loop, daemon=True, name="kingdom-summary-refresher")
+    t.start()
+
+
+_ATTACK_REPORT_RE = re.compile(r"^\s*Attack Report:\s*", re.I | re.M)
+_ATTACK_REPORT_MARKER = "attack report:"
+
+
+def _is_attack_report(raw_text: str, low: Optional[str] = None) -> bool:
+    # The marker almost always opens the paste; only fall back to the
+    # line-anchored regex when it appears somewhere further down.
+    if raw_text[: len(_ATTACK_REPORT_MARKER)].lower() == _ATTACK_REPORT_MARKER:
+        return True
+    if low is None:
+        low = raw_text.lower()
+    if _ATTACK_REPORT_MARKER not in low:
+        return False
+    return bool(_ATTACK_REPORT_RE.search(raw_text))
+
+
 @app.post("/api/reports/spy")
 def ingest_report(body: RawReportBody):
     raw_text = body.raw_text.strip()
     if not raw_text:
         raise HTTPException(status_code=400, detail="raw_text is empty")
 
-    is_attack = bool(re.search(r"^\s*Attack Report:\s*", raw_text, flags=re.I | re.M))
+    low = raw_text.lower()
+    is_attack = _is_attack_report(raw_text, low)
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
             if is_attack:
                 parsed = parse_attack_report(raw_text)
@@ -1919,13 +2523,27 @@ def ingest_report(body: RawReportBody):
                 if not target:
                     raise HTTPException(status_code=400, detail="Could not parse attack target kingdom")
 
+                names, levels, tiers = _mention_arrays(parsed.get("settlement_mentions") or [])
+                # One round-trip: store the report and its settlement sightings together.
                 cur.execute(
                     """
-                    INSERT INTO public.attack_reports
-                      (observed_at, target_kingdom, target_networth, attack_result, gains_json, casualties_json, raw_text, created_at)
-                    VALUES
-                      (%s, %s, %s, %s, %s::jsonb, %s::jsonb, %s, now())
-                    RETURNING id, created_at
+                    WITH ins AS (
+                        INSERT INTO public.attack_reports
+                          (observed_at, target_kingdom, target_networth, attack_result, gains_json, casualties_json, raw_text, created_at)
+                        VALUES
+                          (%s, %s, %s, %s, %s::jsonb, %s::jsonb, %s, now())
+                        RETURNING id, created_at
+                    ), obs AS (
+                        INSERT INTO public.settlement_observations
+                          (source_type, source_report_id, kingdom, settlement_name, settlement_level, settlement_tier, event_type, event_detail, created_at)
+                        SELECT 'attack', ins.id, %s, m.name, m.lvl, m.tier, %s, %s, now()
+                        FROM ins
+                        CROSS JOIN unnest(%s::text[], %s::int[], %s::text[]) AS m(name, lvl, tier)
+                        ON CONFLICT DO NOTHING
+                        RETURNING 1
+                    )
+                    SELECT ins.id, ins.created_at, (SELECT COUNT(*) FROM obs)::int AS settlement_events
+                    FROM ins
                     """,
                     (
                         parsed.get("received_at"),
@@ -1935,25 +2553,16 @@ def ingest_report(body: RawReportBody):
                         json.dumps(parsed.get("gains") or {}),
                         json.dumps(parsed.get("casualties") or {}),
                         raw_text,
+                        target,
+                        str(parsed.get("settlement_event_type") or "seen"),
+                        parsed.get("settlement_event_detail"),
+                        names,
+                        levels,
+                        tiers,
                     ),
                 )
                 stored = cur.fetchone()
-
-                events = 0
-                for s in parsed.get("settlement_mentions") or []:
-                    inserted = _insert_settlement_observation(
-                        cur,
-                        source_type="attack",
-                        source_report_id=stored["id"] if stored else None,
-                        kingdom=target,
-                        settlement_name=str(s.get("settlement_name") or "").strip(),
-                        settlement_level=s.get("settlement_level"),
-                        settlement_tier=s.get("settlement_tier"),
-                        event_type=str(parsed.get("settlement_event_type") or "seen"),
-                        event_detail=parsed.get("settlement_event_detail"),
-                    )
-                    if inserted:
-                        events += 1
+                events = int(stored.pop("settlement_events") or 0) if stored else 0
 
                 auto_known_hit_inserted = False
                 if stored:
@@ -1974,44 +2583,50 @@ def ingest_report(body: RawReportBody):
                     "auto_known_hit_inserted": bool(auto_known_hit_inserted),
                 }
 
-            parsed = parse_spy_report(raw_text)
+            parsed = parse_spy_report(raw_text, low)
             kingdom = str(parsed.get("target") or "").strip()
             if not kingdom:
                 raise HTTPException(status_code=400, detail="Could not parse spy report target kingdom")
 
+            names, levels, tiers = _mention_arrays(_parse_settlement_mentions(raw_text))
             cur.execute(
                 """
-                INSERT INTO public.spy_reports
-                  (created_at, kingdom, alliance, defense_power, castles, raw)
-                VALUES
-                  (now(), %s, %s, %s, %s, %s)
-                RETURNING id, created_at
+                WITH ins AS (
+                    INSERT INTO public.spy_reports
+                      (created_at, kingdom, alliance, defense_power, castles, raw, raw_gz, parsed_json, parsed_version)
+                    VALUES
+                      (now(), %s, %s, %s, %s, '', %s, %s::jsonb, %s)
+                    RETURNING id, created_at
+                ), obs AS (
+                    INSERT INTO public.settlement_observations
+                      (source_type, source_report_id, kingdom, settlement_name, settlement_level, settlement_tier, event_type, event_detail, created_at)
+                    SELECT 'spy', ins.id, %s, m.name, m.lvl, m.tier, 'seen', NULL, now()
+                    FROM ins
+                    CROSS JOIN unnest(%s::text[], %s::int[], %s::text[]) AS m(name, lvl, tier)
+                    ON CONFLICT DO NOTHING
+                    RETURNING 1
+                )
+                SELECT ins.id, ins.created_at, (SELECT COUNT(*) FROM obs)::int AS settlement_events
+                FROM ins
                 """,
                 (
                     kingdom,
                     parsed.get("alliance"),
                     parsed.get("defender_dp"),
                     parsed.get("castles"),
-                    raw_text,
+                    _gzip_raw(raw_text),
+                    json.dumps(parsed),
+                    SPY_PARSE_VERSION,
+                    kingdom,
+                    names,
+                    levels,
+                    tiers,
                 ),
             )
             stored = cur.fetchone()
-
-            events = 0
-            for s in _parse_settlement_mentions(raw_text):
-                inserted = _insert_settlement_observation(
-                    cur,
-                    source_type="spy",
-                    source_report_id=stored["id"] if stored else None,
-                    kingdom=kingdom,
-                    settlement_name=str(s.get("settlement_name") or "").strip(),
-                    settlement_level=s.get("settlement_level"),
-                    settlement_tier=s.get("settlement_tier"),
-                    event_type="seen",
-                    event_detail=None,
-                )
-                if inserted:
-                    events += 1
+            events = int(stored.pop("settlement_events") or 0) if stored else 0
+            if stored:
+                cur.execute("SELECT pg_notify(%s, %s)", (SPY_REPORT_CHANNEL, str(stored["id"])))
 
         conn.commit()
         return {
@@ -2021,110 +2636,115 @@ def ingest_report(body: RawReportBody):
             "parsed": parsed,
             "settlement_events": events,
         }
-    finally:
-        conn.close()
+
+
+@app.post("/api/reports/spy/bulk")
+def ingest_spy_reports_bulk(body: RawReportsBulkBody, token: str = ""):
+    """
+    Backfill path: parse many spy reports and COPY them in one statement.
+    Settlement sightings are picked up by the settlement observer, which is
+    woken once the batch commits.
+    """
+    expected = (os.getenv("SETTLEMENT_BACKFILL_TOKEN", "") or "").strip()
+    if not expected:
+        raise HTTPException(status_code=500, detail="SETTLEMENT_BACKFILL_TOKEN is not set")
+    if token != expected:
+        raise HTTPException(status_code=403, detail="Invalid backfill token")
+
+    now = datetime.now(timezone.utc)
+    rows = []
+    skipped = []
+    for idx, text in enumerate(body.raw_texts):
+        raw_text = (text or "").strip()
+        if not raw_text:
+            skipped.append({"index": idx, "reason": "empty"})
+            continue
+        low = raw_text.lower()
+        if _is_attack_report(raw_text, low):
+            skipped.append({"index": idx, "reason": "attack report"})
+            continue
+        parsed = parse_spy_report(raw_text, low)
+        kingdom = str(parsed.get("target") or "").strip()
+        if not kingdom:
+            skipped.append({"index": idx, "reason": "no target kingdom"})
+            continue
+        rows.append(
+            (
+                now,
+                kingdom,
+                parsed.get("alliance"),
+                parsed.get("defender_dp"),
+                parsed.get("castles"),
+                "",
+                _gzip_raw(raw_text),
+                json.dumps(parsed),
+                SPY_PARSE_VERSION,
+            )
+        )
+
+    if rows:
+        with get_pool().connection() as conn:
+            with conn.cursor() as cur:
+                with cur.copy(
+                    """
+                    COPY public.spy_reports
+                      (created_at, kingdom, alliance, defense_power, castles, raw, raw_gz, parsed_json, parsed_version)
+                    FROM STDIN
+                    """
+                ) as cp:
+                    for row in rows:
+                        cp.write_row(row)
+                cur.execute("SELECT pg_notify(%s, %s)", (SPY_REPORT_CHANNEL, "bulk"))
+            conn.commit()
+
+    return {"ok": True, "inserted": len(rows), "skipped": skipped}
 
 
 @app.get("/api/settlements/tracked")
-def tracked_settlements(request: Request, kingdom: str = "", limit: int = 500):
+def tracked_settlements(
+    kingdom: str = "",
+    limit: int = 500,
+    scope: Optional[Dict[str, Any]] = Depends(_get_scope_from_request),
+):
     s = kingdom.strip()
     lim = max(1, min(int(limit), 1000))
-    scope = _get_scope_from_request(request)
     scoped_alliances = (scope or {}).get("alliance_names") or []
 
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
-            if s and scoped_alliances:
-                cur.execute(
-                    """
-                    SELECT
-                        o.kingdom,
-                        o.settlement_name,
-                        MAX(o.settlement_level) AS latest_level,
-                        MAX(o.created_at) AS last_seen_at,
-                        COUNT(*)::int AS sightings,
-                        COUNT(*) FILTER (WHERE o.event_type = 'take_attempt_failed')::int AS failed_take_attempts,
-                        COUNT(*) FILTER (WHERE o.event_type = 'captured')::int AS captures
-                    FROM public.settlement_observations o
-                    WHERE o.kingdom ILIKE %s
-                      AND EXISTS (
-                        SELECT 1
-                        FROM public.spy_reports s
-                        WHERE s.kingdom = o.kingdom
-                          AND COALESCE(s.alliance,'') = ANY(%s)
-                      )
-                    GROUP BY o.kingdom, o.settlement_name
-                    ORDER BY last_seen_at DESC
-                    LIMIT %s
-                    """,
-                    (f"%{s}%", scoped_alliances, lim),
-                )
-            elif s:
-                cur.execute(
-                    """
-                    SELECT
-                        kingdom,
-                        settlement_name,
-                        MAX(settlement_level) AS latest_level,
-                        MAX(created_at) AS last_seen_at,
-                        COUNT(*)::int AS sightings,
-                        COUNT(*) FILTER (WHERE event_type = 'take_attempt_failed')::int AS failed_take_attempts,
-                        COUNT(*) FILTER (WHERE event_type = 'captured')::int AS captures
-                    FROM public.settlement_observations
-                    WHERE kingdom ILIKE %s
-                    GROUP BY kingdom, settlement_name
-                    ORDER BY last_seen_at DESC
-                    LIMIT %s
-                    """,
-                    (f"%{s}%", lim),
-                )
-            elif scoped_alliances:
-                cur.execute(
-                    """
-                    SELECT
-                        o.kingdom,
-                        o.settlement_name,
-                        MAX(o.settlement_level) AS latest_level,
-                        MAX(o.created_at) AS last_seen_at,
-                        COUNT(*)::int AS sightings,
-                        COUNT(*) FILTER (WHERE o.event_type = 'take_attempt_failed')::int AS failed_take_attempts,
-                        COUNT(*) FILTER (WHERE o.event_type = 'captured')::int AS captures
-                    FROM public.settlement_observations o
-                    WHERE EXISTS (
-                        SELECT 1
-                        FROM public.spy_reports s
-                        WHERE s.kingdom = o.kingdom
-                          AND COALESCE(s.alliance,'') = ANY(%s)
-                    )
-                    GROUP BY o.kingdom, o.settlement_name
-                    ORDER BY last_seen_at DESC
-                    LIMIT %s
-                    """,
-                    (scoped_alliances, lim),
-                )
-            else:
-                cur.execute(
-                    """
-                    SELECT
-                        kingdom,
-                        settlement_name,
-                        MAX(settlement_level) AS latest_level,
-                        MAX(created_at) AS last_seen_at,
-                        COUNT(*)::int AS sightings,
-                        COUNT(*) FILTER (WHERE event_type = 'take_attempt_failed')::int AS failed_take_attempts,
-                        COUNT(*) FILTER (WHERE event_type = 'captured')::int AS captures
-                    FROM public.settlement_observations
-                    GROUP BY kingdom, settlement_name
-                    ORDER BY last_seen_at DESC
-                    LIMIT %s
-                    """,
-                    (lim,),
-                )
+            conds: List[str] = []
+            args: List[Any] = []
+            if s:
+                conds.append("kingdom ILIKE %s")
+                args.append(f"%{s}%")
+            if scoped_alliances:
+                # Uncorrelated semi-join: the visible kingdoms are resolved once
+                # from the (alliance, kingdom) index in the same round-trip.
+                conds.append("kingdom IN (SELECT kingdom FROM public.spy_reports WHERE alliance = ANY(%s))")
+                args.append(scoped_alliances)
+            args.append(lim)
+
+            where = f" WHERE {' AND '.join(conds)}" if conds else ""
+            cur.execute(
+                f"""
+                SELECT
+                    kingdom,
+                    settlement_name,
+                    MAX(settlement_level) AS latest_level,
+                    MAX(created_at) AS last_seen_at,
+                    COUNT(*)::int AS sightings,
+                    COUNT(*) FILTER (WHERE event_type = 'take_attempt_failed')::int AS failed_take_attempts,
+                    COUNT(*) FILTER (WHERE event_type = 'captured')::int AS captures
+                FROM public.settlement_observations
+                {where}
+                GROUP BY kingdom, settlement_name
+                ORDER BY last_seen_at DESC
+                LIMIT %s
+                """,
+                tuple(args),
+            )
             rows = cur.fetchall()
         return {"ok": True, "items": rows}
-    finally:
-        conn.close()
 
 
 @app.post("/api/settlements/backfill")
@@ -2199,36 +2819,54 @@ app.include_router(admin_router, tags=["admin"])
 # -------------------------
 # Startup: start pollers
 # -------------------------
-@app.on_event("startup")
+def _ensure_schema():
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            # Only one worker runs the DDL at a time; the others wait here and
+            # then find every object already in place. Released on commit.
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
+            ensure_auth_tables(cur)
+            ensure_admin_tables(cur)
+            ensure_recon_tables(cur)
+            seed_default_alliances(cur)
+        conn.commit()
+
+
 def _startup():
     world_id = os.getenv("KG_WORLD_ID", "1")
 
     rankings_seconds = int(os.getenv("RANKINGS_POLL_SECONDS", "900"))
     nw_seconds = int(os.getenv("NW_POLL_SECONDS", "240"))
 
-    ensure_auth_tables()
-    ensure_admin_tables()
-    ensure_recon_tables()
-    seed_default_alliances()
+    _ensure_schema()
     start_rankings_poller(poll_seconds=rankings_seconds, world_id=world_id)
     start_nw_poller(poll_seconds=nw_seconds)
     start_settlement_observer()
+    start_kingdom_summary_refresher()
+
+
+def _shutdown():
+    close_http_client()
+    close_pool()
 
 
 # -------------------------
 # SPA fallback
 # -------------------------
-@app.get("/{full_path:path}")
-def spa_fallback(full_path: str):
+def spa_fallback(full_path: str, request: Request):
     if full_path.startswith("api/"):
         raise HTTPException(status_code=404, detail="Not Found")
 
     p = STATIC_DIR / full_path
-    if p.exists() and p.is_file():
-        return FileResponse(str(p))
+    if p.is_file():
+        return _static_file_response(request, p)
 
     index_path = STATIC_DIR / "index.html"
     if index_path.exists():
-        return FileResponse(str(index_path))
+        return _static_file_response(request, index_path)
 
     raise HTTPException(status_code=404, detail="Not Found")
+
+
+if SERVE_STATIC:
+    app.add_api_route("/{full_path:path}", spa_fallback, methods=["GET"])
@@ -1,163 +1,215 @@
+import hashlib
 import os
+import threading
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
-import psycopg
-from psycopg.rows import dict_row
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Request
+from fastapi.responses import Response
+
+from db import get_async_pool
 
 router = APIRouter()
 
+# The list only changes when the pollers write (every few minutes), so the
+# rendered JSON is reused for a short window and dropped as soon as they do.
+NW_KINGDOMS_CACHE_SECONDS = max(0.0, float(os.getenv("NW_KINGDOMS_CACHE_SECONDS", "30")))
+NW_KINGDOMS_CACHE_SIZE = max(1, int(os.getenv("NW_KINGDOMS_CACHE_SIZE", "256")))
+_KINGDOMS_CACHE: Dict[Tuple[int, str], Tuple[float, str]] = {}
+# The pollers invalidate from their own threads.
+_KINGDOMS_CACHE_LOCK = threading.Lock()
+# ETag shared by /kingdoms and /history: (expires_at, etag), same lifetime.
+_FRESHNESS_ETAG: List[Any] = [0.0, ""]
+
+
+def invalidate_kingdoms_cache() -> None:
+    """Called by the pollers after kg_top_kingdoms / nw_history_summary change."""
+    with _KINGDOMS_CACHE_LOCK:
+        _KINGDOMS_CACHE.clear()
+        _FRESHNESS_ETAG[0] = 0.0
+
+
+# -------------------------
+# Conditional GETs
+# -------------------------
+async def _freshness_etag() -> str:
+    """
+    Both NWOT payloads only change when a poller writes, so the ETag is a hash
+    of the newest rankings fetch + newest nw tick rather than of the body.
+    """
+    now = time.monotonic()
+    with _KINGDOMS_CACHE_LOCK:
+        if _FRESHNESS_ETAG[0] > now:
+            return _FRESHNESS_ETAG[1]
+
+    async with get_async_pool().connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT
+                    (SELECT MAX(fetched_at) FROM public.kg_top_kingdoms) AS last_rankings_fetch,
+                    (SELECT MAX(tick_time) FROM public.nw_history) AS last_nw_tick
+                """
+            )
+            row = (await cur.fetchone()) or {}
+
+    raw = f"{row.get('last_rankings_fetch')}|{row.get('last_nw_tick')}".encode("utf-8")
+    etag = '"' + hashlib.blake2b(raw, digest_size=8).hexdigest() + '"'
+    if NW_KINGDOMS_CACHE_SECONDS > 0:
+        with _KINGDOMS_CACHE_LOCK:
+            _FRESHNESS_ETAG[0] = now + NW_KINGDOMS_CACHE_SECONDS
+            _FRESHNESS_ETAG[1] = etag
+    return etag
 
-def _get_dsn() -> str:
-    dsn = os.getenv("DATABASE_URL") or os.getenv("POSTGRES_URL") or ""
-    if not dsn:
-        raise HTTPException(status_code=500, detail="DATABASE_URL is not set")
-    return dsn
 
+def _cache_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={int(NW_KINGDOMS_CACHE_SECONDS)}"}
 
-def _connect() -> psycopg.Connection:
-    return psycopg.connect(_get_dsn(), row_factory=dict_row)
+
+def _not_modified(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match", "")
+    return bool(inm) and any(t.strip().removeprefix("W/") == etag for t in inm.split(","))
 
 
 @router.get("/kingdoms")
-def nw_kingdoms(limit: int = 300, search: str = ""):
+async def nw_kingdoms(request: Request, limit: int = 300, search: str = ""):
     """
     Source of truth for NWOT list = public.kg_top_kingdoms (filled by rankings_poller).
-    We LEFT JOIN nw_history so the UI can show last_tick + points.
+    We LEFT JOIN nw_history_summary (kept by nw_poll) so the UI can show last_tick + points.
     """
+    etag = await _freshness_etag()
+    headers = _cache_headers(etag)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
     s = (search or "").strip()
 
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
+    # ILIKE matching ignores case, so case variants of a search share an entry.
+    cache_key = (limit, s.lower())
+    if NW_KINGDOMS_CACHE_SECONDS > 0:
+        hit = _KINGDOMS_CACHE.get(cache_key)
+        if hit is not None and hit[0] > time.monotonic():
+            return Response(content=hit[1], media_type="application/json", headers=headers)
+
+    async with get_async_pool().connection() as conn:
+        async with conn.cursor() as cur:
             if s:
                 like = f"%{s}%"
-                cur.execute(
+                await cur.execute(
                     """
-                    WITH hist AS (
-                        SELECT kingdom,
-                               MAX(tick_time) AS last_tick,
-                               COUNT(*)::int  AS points
-                        FROM public.nw_history
-                        GROUP BY kingdom
-                    )
-                    SELECT
-                        k.ranking AS rank,
-                        k.kingdom_id,
-                        k.kingdom,
-                        k.networth,
-                        COALESCE(k.alliance, '') AS alliance,
-                        k.fetched_at,
-                        h.last_tick,
-                        COALESCE(h.points, 0)::int AS points
-                    FROM public.kg_top_kingdoms k
-                    LEFT JOIN hist h
-                        ON h.kingdom = k.kingdom
-                    WHERE k.kingdom ILIKE %s
-                       OR COALESCE(k.alliance,'') ILIKE %s
-                    ORDER BY k.ranking ASC NULLS LAST
-                    LIMIT %s
+                    SELECT COALESCE(json_agg(r), '[]')::text AS kingdoms
+                    FROM (
+                        SELECT
+                            k.ranking AS rank,
+                            k.kingdom_id,
+                            k.kingdom,
+                            k.networth,
+                            COALESCE(k.alliance, '') AS alliance,
+                            k.fetched_at,
+                            h.last_tick,
+                            COALESCE(h.points, 0)::int AS points
+                        FROM public.kg_top_kingdoms k
+                        LEFT JOIN public.nw_history_summary h
+                            ON h.kingdom = k.kingdom
+                        WHERE k.kingdom ILIKE %s
+                           OR COALESCE(k.alliance,'') ILIKE %s
+                        ORDER BY k.ranking ASC NULLS LAST
+                        LIMIT %s
+                    ) r
                     """,
                     (like, like, limit),
                 )
             else:
-                cur.execute(
+                await cur.execute(
                     """
-                    WITH hist AS (
-                        SELECT kingdom,
-                               MAX(tick_time) AS last_tick,
-                               COUNT(*)::int  AS points
-                        FROM public.nw_history
-                        GROUP BY kingdom
-                    )
-                    SELECT
-                        k.ranking AS rank,
-                        k.kingdom_id,
-                        k.kingdom,
-                        k.networth,
-                        COALESCE(k.alliance, '') AS alliance,
-                        k.fetched_at,
-                        h.last_tick,
-                        COALESCE(h.points, 0)::int AS points
-                    FROM public.kg_top_kingdoms k
-                    LEFT JOIN hist h
-                        ON h.kingdom = k.kingdom
-                    ORDER BY k.ranking ASC NULLS LAST
-                    LIMIT %s
+                    SELECT COALESCE(json_agg(r), '[]')::text AS kingdoms
+                    FROM (
+                        SELECT
+                            k.ranking AS rank,
+                            k.kingdom_id,
+                            k.kingdom,
+                            k.networth,
+                            COALESCE(k.alliance, '') AS alliance,
+                            k.fetched_at,
+                            h.last_tick,
+                            COALESCE(h.points, 0)::int AS points
+                        FROM public.kg_top_kingdoms k
+                        LEFT JOIN public.nw_history_summary h
+                            ON h.kingdom = k.kingdom
+                        ORDER BY k.ranking ASC NULLS LAST
+                        LIMIT %s
+                    ) r
                     """,
                     (limit,),
                 )
-            rows = cur.fetchall()
+            row = await cur.fetchone()
 
-        return {"ok": True, "kingdoms": rows}
-    finally:
-        conn.close()
+        # Postgres renders the JSON; hand the text straight to the client.
+        body = '{"ok":true,"kingdoms":' + row["kingdoms"] + "}"
+        if NW_KINGDOMS_CACHE_SECONDS > 0:
+            # Keys come from the client; drop the oldest entry once full.
+            with _KINGDOMS_CACHE_LOCK:
+                _KINGDOMS_CACHE.pop(cache_key, None)
+                if len(_KINGDOMS_CACHE) >= NW_KINGDOMS_CACHE_SIZE:
+                    _KINGDOMS_CACHE.pop(next(iter(_KINGDOMS_CACHE)))
+                _KINGDOMS_CACHE[cache_key] = (time.monotonic() + NW_KINGDOMS_CACHE_SECONDS, body)
+        return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.get("/history/{kingdom}")
-def nw_history(kingdom: str, hours: int = 24):
+async def nw_history(request: Request, kingdom: str, hours: int = 24):
     """
-    Returns chart points: [{t: ISO8601, v: networth}, ...]
+    Returns chart points: [{t: ISO8601, v: networth}, ...], built by Postgres.
     """
+    etag = await _freshness_etag()
+    headers = _cache_headers(etag)
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
     since = datetime.now(timezone.utc) - timedelta(hours=hours)
 
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_pool().connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
-                SELECT tick_time, networth
+                SELECT COALESCE(
+                    json_agg(json_build_object('t', tick_time, 'v', networth::bigint) ORDER BY tick_time ASC),
+                    '[]'
+                )::text AS points
                 FROM public.nw_history
                 WHERE kingdom = %s
                   AND tick_time >= %s
-                ORDER BY tick_time ASC
+                  AND tick_time IS NOT NULL
+                  AND networth IS NOT NULL
                 """,
                 (kingdom, since),
             )
-            rows = cur.fetchall()
-
-        points = []
-        for r in rows:
-            tt = r.get("tick_time")
-            nw = r.get("networth")
-            if tt is None or nw is None:
-                continue
-            points.append({"t": tt.isoformat(), "v": int(nw)})
+            row = await cur.fetchone()
 
-        return points
-    finally:
-        conn.close()
+        return Response(content=row["points"], media_type="application/json", headers=headers)
 
 
 @router.get("/status")
-def nw_status():
+async def nw_status():
     """
     Returns source freshness for rankings->nw pipeline.
     """
     now = datetime.now(timezone.utc)
 
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
+    async with get_async_pool().connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
                 """
-                SELECT MAX(fetched_at) AS last_rankings_fetch
-                FROM public.kg_top_kingdoms
-                """
-            )
-            r1 = cur.fetchone() or {}
-
-            cur.execute(
-                """
-                SELECT MAX(tick_time) AS last_nw_tick
-                FROM public.nw_history
+                SELECT
+                    (SELECT MAX(fetched_at) FROM public.kg_top_kingdoms) AS last_rankings_fetch,
+                    (SELECT MAX(tick_time) FROM public.nw_history) AS last_nw_tick
                 """
             )
-            r2 = cur.fetchone() or {}
+            row = (await cur.fetchone()) or {}
 
-        last_fetch = r1.get("last_rankings_fetch")
-        last_tick = r2.get("last_nw_tick")
+        last_fetch = row.get("last_rankings_fetch")
+        last_tick = row.get("last_nw_tick")
 
         fetch_age_s = None
         tick_age_s = None
@@ -174,5 +226,3 @@ def nw_status():
             "rankings_age_seconds": fetch_age_s,
             "nw_tick_age_seconds": tick_age_s,
         }
-    finally:
-        conn.close()
@@ -1,11 +1,10 @@
 import os
 import threading
-import time
 from datetime import datetime, timezone, timedelta
-from typing import List, Optional, Tuple
+from typing import Optional, Tuple
 
-import psycopg
-from psycopg.rows import dict_row
+from db import SCHEMA_LOCK_KEY, get_pool
+from nw_api import invalidate_kingdoms_cache
 
 KG_TICK_DELAY_SECONDS = float(os.getenv("KG_TICK_DELAY_SECONDS", "45"))
 MAX_SOURCE_AGE_SECONDS = int(os.getenv("NW_MAX_SOURCE_AGE_SECONDS", "540"))
@@ -26,36 +25,69 @@ def _next_5min_boundary_utc(now: datetime) -> datetime:
 
 
 def _sleep_until(dt: datetime):
-    while True:
-        now = datetime.now(timezone.utc)
-        sec = (dt - now).total_seconds()
-        if sec <= 0:
-            return
-        time.sleep(min(2.0, sec))
+    sec = (dt - datetime.now(timezone.utc)).total_seconds()
+    if sec > 0:
+        _STOP_EVENT.wait(sec)
 
 
-def _get_dsn() -> str:
-    dsn = os.getenv("DATABASE_URL") or os.getenv("POSTGRES_URL") or ""
-    if not dsn:
-        raise RuntimeError("DATABASE_URL is not set")
-    return dsn
+def _month_start(dt: datetime) -> datetime:
+    return dt.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
 
-def _connect() -> psycopg.Connection:
-    return psycopg.connect(_get_dsn(), row_factory=dict_row)
+def _next_month(month_start: datetime) -> datetime:
+    return (month_start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+_PARTITIONED_THROUGH: Optional[datetime] = None
+
+
+def _ensure_history_partitions(now: datetime):
+    """
+    nw_history is range-partitioned by month on tick_time; keep partitions for
+    the current and next month in place. Only touches the DB when a month
+    boundary has been crossed since the last check.
+    """
+    global _PARTITIONED_THROUGH
+    start = _month_start(now)
+    until = _next_month(_next_month(start))
+    if _PARTITIONED_THROUGH is not None and _PARTITIONED_THROUGH >= until:
+        return
+
+    with get_pool().connection() as conn:
+        with conn.cursor() as cur:
+            # Every worker's poller crosses the month boundary at the same time.
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('public.nw_history');")
+            row = cur.fetchone()
+            # Databases created before partitioning keep their plain table.
+            if row and row.get("relkind") == "p":
+                m = start
+                while m < until:
+                    nm = _next_month(m)
+                    cur.execute(
+                        f"""
+                        CREATE TABLE IF NOT EXISTS public.nw_history_{m:%Y_%m}
+                        PARTITION OF public.nw_history
+                        FOR VALUES FROM ('{m.isoformat()}') TO ('{nm.isoformat()}');
+                        """
+                    )
+                    m = nm
+        conn.commit()
+    _PARTITIONED_THROUGH = until
 
 
 def _ensure_tables():
-    conn = _connect()
-    try:
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
+            # Same lock as main._ensure_schema, so workers don't race on the DDL.
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS public.nw_history (
                     kingdom   TEXT NOT NULL,
                     tick_time TIMESTAMPTZ NOT NULL,
                     networth  BIGINT NOT NULL,
                     PRIMARY KEY (kingdom, tick_time)
-                );
+                ) PARTITION BY RANGE (tick_time);
             """)
 
             cur.execute("""
@@ -63,6 +95,36 @@ def _ensure_tables():
                 ON public.nw_history (kingdom, tick_time DESC);
             """)
 
+            # Global MAX(tick_time) for /api/nw/status and the admin overview.
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS ix_nw_history_tick_time
+                ON public.nw_history (tick_time);
+            """)
+
+            # Covers /api/nw/history (kingdom + tick_time range, networth) so the
+            # chart can be served by an index-only scan.
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS ix_nw_history_kingdom_time_cover
+                ON public.nw_history (kingdom, tick_time) INCLUDE (networth);
+            """)
+
+            # Per-kingdom last tick + point count for the NWOT list, so the API
+            # doesn't aggregate all of nw_history on every request. Refreshed
+            # after each tick's history write.
+            cur.execute("""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS public.nw_history_summary AS
+                SELECT kingdom,
+                       MAX(tick_time) AS last_tick,
+                       COUNT(*)::int  AS points
+                FROM public.nw_history
+                GROUP BY kingdom;
+            """)
+
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ux_nw_history_summary_kingdom
+                ON public.nw_history_summary (kingdom);
+            """)
+
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS public.nw_latest (
                     kingdom    TEXT PRIMARY KEY,
@@ -72,52 +134,29 @@ def _ensure_tables():
                 );
             """)
         conn.commit()
-    finally:
-        conn.close()
+    _ensure_history_partitions(datetime.now(timezone.utc))
 
 
-# Snapshot is (kingdom, rank, networth)
-Snapshot = List[Tuple[str, int, int]]
+# Set once kg_top_kingdoms has been seen; tables aren't dropped at runtime, so
+# the to_regclass probe stops running after that.
+_KG_TOP_EXISTS = False
 
 
-def _fetch_from_kg_top() -> Tuple[Snapshot, Optional[datetime]]:
-    conn = _connect()
-    try:
+def _probe_kg_top_fetched_at() -> Optional[datetime]:
+    """Newest kg_top_kingdoms.fetched_at (None if the table is missing or empty)."""
+    global _KG_TOP_EXISTS
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("SELECT to_regclass('public.kg_top_kingdoms') AS t;")
-            reg = cur.fetchone()
-            if not reg or not reg.get("t"):
-                return ([], None)
+            if not _KG_TOP_EXISTS:
+                cur.execute("SELECT to_regclass('public.kg_top_kingdoms') AS t;")
+                reg = cur.fetchone()
+                if not reg or not reg.get("t"):
+                    return None
+                _KG_TOP_EXISTS = True
 
-            cur.execute("""
-                SELECT kingdom, COALESCE(ranking, 999999) AS rank, networth, fetched_at
-                FROM public.kg_top_kingdoms
-                ORDER BY ranking ASC NULLS LAST
-                LIMIT 300;
-            """)
-            rows = cur.fetchall()
-
-        out: Snapshot = []
-        latest_fetched_at: Optional[datetime] = None
-        for r in rows:
-            k = (r.get("kingdom") or "").strip()
-            if not k or r.get("networth") is None:
-                continue
-            out.append((k, int(r.get("rank") or 999999), int(r["networth"])))
-            fa = r.get("fetched_at")
-            if isinstance(fa, datetime):
-                if latest_fetched_at is None or fa > latest_fetched_at:
-                    latest_fetched_at = fa
-        return (out, latest_fetched_at)
-    finally:
-        conn.close()
-
-
-def _fetch_top300_resilient() -> Tuple[str, Snapshot, Optional[datetime]]:
-    rows, fetched_at = _fetch_from_kg_top()
-    if rows:
-        return ("kg_top_kingdoms", rows, fetched_at)
-    return ("none", [], None)
+            cur.execute("SELECT MAX(fetched_at) AS fetched_at FROM public.kg_top_kingdoms;", prepare=True)
+            row = cur.fetchone()
+    return row.get("fetched_at") if row else None
 
 
 def _is_fresh(source_ts: Optional[datetime], now: datetime) -> bool:
@@ -126,69 +165,80 @@ def _is_fresh(source_ts: Optional[datetime], now: datetime) -> bool:
     return (now - source_ts).total_seconds() <= MAX_SOURCE_AGE_SECONDS
 
 
-def _fetch_snapshot_for_tick(tick_time: datetime) -> Tuple[str, Snapshot, Optional[datetime]]:
+def _wait_for_tick_source(tick_time: datetime) -> Optional[datetime]:
     """
     Wait briefly for rankings_poller to finish writing this tick's data.
-    Accept only snapshots fetched at/after tick_time (UTC 5-min boundary).
+    Only the fetched_at probe runs while waiting; returns the last value seen.
     """
     deadline = datetime.now(timezone.utc) + timedelta(seconds=SOURCE_WAIT_TIMEOUT_SECONDS)
-    latest_source = "none"
-    latest_snapshot: Snapshot = []
-    latest_fetched_at: Optional[datetime] = None
+    fetched_at: Optional[datetime] = None
 
     while datetime.now(timezone.utc) <= deadline:
-        source, snapshot, source_fetched_at = _fetch_top300_resilient()
-        latest_source = source
-        latest_snapshot = snapshot
-        latest_fetched_at = source_fetched_at
-
-        if snapshot and source_fetched_at is not None and source_fetched_at >= tick_time:
-            return (source, snapshot, source_fetched_at)
-
-        time.sleep(max(0.5, SOURCE_WAIT_STEP_SECONDS))
-
-    return (latest_source, latest_snapshot, latest_fetched_at)
+        fetched_at = _probe_kg_top_fetched_at()
+        if fetched_at is not None and fetched_at >= tick_time:
+            return fetched_at
 
+        if _STOP_EVENT.wait(max(0.5, SOURCE_WAIT_STEP_SECONDS)):
+            break
 
-def _upsert_history(points: List[Tuple[str, datetime, int]]):
-    if not points:
-        return
-    conn = _connect()
-    try:
-        with conn.cursor() as cur:
-            cur.executemany("""
-                INSERT INTO public.nw_history (kingdom, tick_time, networth)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (kingdom, tick_time)
-                DO UPDATE SET networth = EXCLUDED.networth;
-            """, points)
-        conn.commit()
-    finally:
-        conn.close()
+    return fetched_at
 
 
-def _upsert_latest(snapshot: Snapshot, now: datetime):
-    if not snapshot:
-        return
-    conn = _connect()
-    try:
+def _write_tick_from_kg_top(tick_time: datetime) -> Tuple[int, Optional[int]]:
+    """
+    Copy the top 300 of kg_top_kingdoms into nw_latest + nw_history in one
+    server-side statement and refresh nw_history_summary, all in one
+    transaction. Returns (points written, Galileo's networth).
+    """
+    with get_pool().connection() as conn:
         with conn.cursor() as cur:
-            cur.executemany("""
-                INSERT INTO public.nw_latest (kingdom, rank, networth, updated_at)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (kingdom)
-                DO UPDATE SET
-                    rank = EXCLUDED.rank,
-                    networth = EXCLUDED.networth,
-                    updated_at = EXCLUDED.updated_at;
-            """, [(k, rank, nw, now) for (k, rank, nw) in snapshot])
+            # ON CONFLICT can't touch a row twice in one INSERT, so a kingdom
+            # listed twice keeps its lowest-ranked row.
+            cur.execute("""
+                WITH top AS (
+                    SELECT btrim(kingdom) AS kingdom, ranking, networth
+                    FROM public.kg_top_kingdoms
+                    ORDER BY ranking ASC NULLS LAST
+                    LIMIT 300
+                ),
+                snap AS (
+                    SELECT DISTINCT ON (kingdom)
+                        kingdom, COALESCE(ranking, 999999) AS rank, networth
+                    FROM top
+                    WHERE kingdom <> '' AND networth IS NOT NULL
+                    ORDER BY kingdom, ranking DESC NULLS FIRST
+                ),
+                latest AS (
+                    INSERT INTO public.nw_latest (kingdom, rank, networth, updated_at)
+                    SELECT kingdom, rank, networth, %(tick)s FROM snap
+                    ON CONFLICT (kingdom)
+                    DO UPDATE SET
+                        rank = EXCLUDED.rank,
+                        networth = EXCLUDED.networth,
+                        updated_at = EXCLUDED.updated_at
+                ),
+                history AS (
+                    INSERT INTO public.nw_history (kingdom, tick_time, networth)
+                    SELECT kingdom, %(tick)s, networth FROM snap
+                    ON CONFLICT (kingdom, tick_time)
+                    DO UPDATE SET networth = EXCLUDED.networth
+                )
+                SELECT
+                    COUNT(*) AS points,
+                    MAX(networth) FILTER (WHERE kingdom = 'Galileo') AS galileo
+                FROM snap;
+            """, {"tick": tick_time}, prepare=True)
+            row = cur.fetchone() or {}
+            points = int(row.get("points") or 0)
+            if points:
+                cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY public.nw_history_summary;")
         conn.commit()
-    finally:
-        conn.close()
+    return (points, row.get("galileo"))
 
 
 _POLL_THREAD: Optional[threading.Thread] = None
-_STOP = False
+# Set by stop_nw_poller; every wait in the loop returns as soon as it is.
+_STOP_EVENT = threading.Event()
 
 
 def start_nw_poller(poll_seconds: int = 300):
@@ -196,34 +246,37 @@ def start_nw_poller(poll_seconds: int = 300):
     Tick-aligned NW poller:
     - wakes up exactly on :00/:05/:10...
     - waits KG_TICK_DELAY_SECONDS (same as rankings poller)
-    - reads kg_top_kingdoms and writes nw_latest + nw_history
+    - reads kg_top_kingdoms and writes nw_latest + nw_history (then refreshes nw_history_summary)
     - uses tick boundary time as tick_time (perfect alignment)
     """
-    global _POLL_THREAD, _STOP
+    global _POLL_THREAD
 
     if _POLL_THREAD and _POLL_THREAD.is_alive():
         return
 
     _ensure_tables()
-    _STOP = False
+    _STOP_EVENT.clear()
 
     def loop():
         # small boot jitter
-        time.sleep(1.0)
+        _STOP_EVENT.wait(1.0)
 
-        while not _STOP:
+        while not _STOP_EVENT.is_set():
             try:
                 target = _next_5min_boundary_utc(datetime.now(timezone.utc))
                 _sleep_until(target)
+                if _STOP_EVENT.is_set():
+                    break
 
-                if KG_TICK_DELAY_SECONDS > 0:
-                    time.sleep(KG_TICK_DELAY_SECONDS)
+                if KG_TICK_DELAY_SECONDS > 0 and _STOP_EVENT.wait(KG_TICK_DELAY_SECONDS):
+                    break
 
-                source, snapshot, source_fetched_at = _fetch_snapshot_for_tick(target)
+                source_fetched_at = _wait_for_tick_source(target)
 
-                if not snapshot:
+                if source_fetched_at is None:
                     print("[nw_poll] source=none no snapshot available")
                 else:
+                    source = "kg_top_kingdoms"
                     now = target  # <- align exactly to tick boundary
                     if not _is_fresh(source_fetched_at, now):
                         print(
@@ -232,7 +285,7 @@ def start_nw_poller(poll_seconds: int = 300):
                             f"(max_age={MAX_SOURCE_AGE_SECONDS}s)"
                         )
                         continue
-                    if source_fetched_at is None or source_fetched_at < target:
+                    if source_fetched_at < target:
                         print(
                             f"[nw_poll] no in-tick snapshot ready: source={source} "
                             f"fetched_at={source_fetched_at} tick={now.isoformat()} "
@@ -240,17 +293,18 @@ def start_nw_poller(poll_seconds: int = 300):
                         )
                         continue
 
-                    _upsert_latest(snapshot, now)
-
-                    points = [(k, now, nw) for (k, _rank, nw) in snapshot]
-                    _upsert_history(points)
+                    _ensure_history_partitions(now)
+                    points, gal = _write_tick_from_kg_top(now)
+                    if not points:
+                        print("[nw_poll] source=none no snapshot available")
+                        continue
+                    invalidate_kingdoms_cache()
 
                     # Debug Galileo NW each tick
-                    gal = next((nw for (k, _r, nw) in snapshot if k == "Galileo"), None)
                     if gal is not None:
-                        print(f"[nw_poll] source={source} ok: wrote {len(points)} points @ {now.isoformat()} GalileoNW={gal}")
+                        print(f"[nw_poll] source={source} ok: wrote {points} points @ {now.isoformat()} GalileoNW={gal}")
                     else:
-                        print(f"[nw_poll] source={source} ok: wrote {len(points)} points @ {now.isoformat()}")
+                        print(f"[nw_poll] source={source} ok: wrote {points} points @ {now.isoformat()}")
 
             except Exception as e:
                 print(f"[nw_poll] error: {repr(e)}")
@@ -263,5 +317,6 @@ def start_nw_poller(poll_seconds: int = 300):
 
 
 def stop_nw_poller():
-    global _STOP
-    _STOP = True
+    global _KG_TOP_EXISTS
+    _STOP_EVENT.set()
+    _KG_TOP_EXISTS = False
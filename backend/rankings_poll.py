@@ -3,13 +3,18 @@ import json
 import time
 import threading
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from typing import Dict, List, Optional, Tuple
 
 import httpx
+import orjson
 import psycopg
 from psycopg.rows import dict_row
 
+from db import SCHEMA_LOCK_KEY
+from nw_api import invalidate_kingdoms_cache
+
 KG_RANKINGS_URL = os.getenv(
     "KG_RANKINGS_URL",
     "https://www.kingdomgame.net/WebService/Kingdoms.asmx/GetKingdomRankings",
@@ -20,6 +25,8 @@ KG_RANKINGS_URL = os.getenv(
 KG_TICK_DELAY_SECONDS = float(os.getenv("KG_TICK_DELAY_SECONDS", "45"))
 KG_REQUEST_TIMEOUT_SECONDS = float(os.getenv("KG_REQUEST_TIMEOUT_SECONDS", "30"))
 KG_PAGE_RETRIES = max(1, int(os.getenv("KG_PAGE_RETRIES", "3")))
+# Rankings pages requested at once once the page size is known.
+KG_PAGE_CONCURRENCY = max(1, int(os.getenv("KG_PAGE_CONCURRENCY", "3")))
 
 
 # -------------------------
@@ -35,12 +42,9 @@ def _next_5min_boundary_utc(now: datetime) -> datetime:
 
 
 def _sleep_until(dt: datetime):
-    while True:
-        now = datetime.now(timezone.utc)
-        sec = (dt - now).total_seconds()
-        if sec <= 0:
-            return
-        time.sleep(min(2.0, sec))
+    sec = (dt - datetime.now(timezone.utc)).total_seconds()
+    if sec > 0:
+        time.sleep(sec)
 
 
 def _log(msg: str):
@@ -65,6 +69,9 @@ def _ensure_tables():
     conn = _connect()
     try:
         with conn.cursor() as cur:
+            # Same lock as main._ensure_schema: concurrent CREATE EXTENSION /
+            # CREATE ... IF NOT EXISTS from several workers can still collide.
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
             cur.execute(
                 """
                 CREATE TABLE IF NOT EXISTS public.kg_top_kingdoms (
@@ -83,6 +90,28 @@ def _ensure_tables():
                 ON public.kg_top_kingdoms (ranking ASC NULLS LAST);
                 """
             )
+            # Trigram indexes for the '%term%' ILIKE search in /api/nw/kingdoms
+            # (kingdom OR COALESCE(alliance, '')); the planner can BitmapOr the
+            # two. pg_trgm needs CREATE privilege on the database; skip if absent.
+            cur.execute(
+                """
+                DO $$
+                BEGIN
+                    BEGIN
+                        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                    EXCEPTION WHEN insufficient_privilege THEN
+                        RAISE NOTICE 'pg_trgm unavailable; NWOT search stays unindexed';
+                    END;
+                    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                        CREATE INDEX IF NOT EXISTS kg_top_kingdoms_kingdom_trgm_idx
+                        ON public.kg_top_kingdoms USING GIN (kingdom gin_trgm_ops);
+                        CREATE INDEX IF NOT EXISTS kg_top_kingdoms_alliance_trgm_idx
+                        ON public.kg_top_kingdoms USING GIN ((COALESCE(alliance, '')) gin_trgm_ops);
+                    END IF;
+                END
+                $$;
+                """
+            )
         conn.commit()
     finally:
         conn.close()
@@ -96,7 +125,7 @@ def _parse_kg_d_json(resp_json: Dict) -> Dict:
     if not d:
         return {}
     try:
-        return json.loads(d)
+        return orjson.loads(d)
     except Exception:
         return {}
 
@@ -303,6 +332,22 @@ def _resolve_rankings_creds() -> List[Dict[str, object]]:
     return creds
 
 
+_KG_CLIENT: Optional[httpx.Client] = None
+
+
+def _kg_client() -> httpx.Client:
+    # Shared by the poller thread and, during a tick, its page-fetch workers
+    # (KG_PAGE_CONCURRENCY). httpx.Client and its cookie jar are thread-safe;
+    # the jar is only cleared from the poller thread, before any page request.
+    global _KG_CLIENT
+    if _KG_CLIENT is None:
+        _KG_CLIENT = httpx.Client(
+            timeout=KG_REQUEST_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_keepalive_connections=KG_PAGE_CONCURRENCY, keepalive_expiry=600),
+        )
+    return _KG_CLIENT
+
+
 # -------------------------
 # Poll once (paginated to 300)
 # -------------------------
@@ -330,7 +375,7 @@ def _poll_rankings_once(*, world_id: str, creds: Dict[str, object]) -> Tuple[int
             try:
                 r = client.post(KG_RANKINGS_URL, headers=headers, json=payload)
                 r.raise_for_status()
-                raw = r.json()
+                raw = orjson.loads(r.content)
                 parsed = _parse_kg_d_json(raw) or raw
                 return parsed if isinstance(parsed, dict) else {}
             except Exception as e:
@@ -339,37 +384,64 @@ def _poll_rankings_once(*, world_id: str, creds: Dict[str, object]) -> Tuple[int
                     time.sleep(min(2 ** (attempt - 1), 4) + random.uniform(0.0, 0.5))
         raise last_err or RuntimeError("rankings page request failed")
 
-    with httpx.Client(timeout=KG_REQUEST_TIMEOUT_SECONDS) as client:
-        for start in starts_to_try:
-            try:
-                parsed = post_rankings_page(client, start)
-                parsed_last = parsed
-                chunk = _extract_kingdoms(parsed)
-            except Exception:
-                chunk = []
-            if chunk:
-                for row in chunk:
-                    kid = row["kingdom_id"]
-                    if kid in seen_ids:
-                        continue
-                    seen_ids.add(kid)
-                    all_rows.append(row)
-                # If KG already returns the full top list, avoid extra paging requests.
-                if len(all_rows) >= 250:
-                    break
-                # Continue paging from current offset.
-                start = max(1, start) + max(1, len(chunk))
+    def try_rankings_page(client: httpx.Client, start_number: int) -> Optional[Dict]:
+        try:
+            return post_rankings_page(client, start_number)
+        except Exception:
+            return None
+
+    page_size: Optional[int] = None
+    # One client for the life of the process so each tick can reuse the
+    # kept-alive KG connection; cookies never carry over between ticks. The
+    # jar is cleared here, on the poller thread, before any request is sent or
+    # any page-fetch worker is started, so no in-flight request sees it change.
+    client = _kg_client()
+    client.cookies.clear()
+    for start in starts_to_try:
+        try:
+            parsed = post_rankings_page(client, start)
+            parsed_last = parsed
+            chunk = _extract_kingdoms(parsed)
+        except Exception:
+            chunk = []
+        if chunk:
+            for row in chunk:
+                kid = row["kingdom_id"]
+                if kid in seen_ids:
+                    continue
+                seen_ids.add(kid)
+                all_rows.append(row)
+            # If KG already returns the full top list, avoid extra paging requests.
+            if len(all_rows) >= 250:
                 break
+            # Continue paging from current offset.
+            start = max(1, start) + max(1, len(chunk))
+            page_size = len(chunk)
+            break
 
-        while len(all_rows) < 300:
-            try:
-                parsed = post_rankings_page(client, start)
-            except Exception:
+    done = False
+    while len(all_rows) < 300 and not done:
+        # With a known page size the next few page offsets are known up
+        # front, so they are fetched together and consumed in order.
+        n_pages = 1
+        if page_size:
+            n_pages = min(KG_PAGE_CONCURRENCY, -(-(300 - len(all_rows)) // page_size))
+        starts = [start + i * (page_size or 0) for i in range(n_pages)]
+        if n_pages > 1:
+            with ThreadPoolExecutor(max_workers=n_pages) as ex:
+                pages = list(ex.map(lambda st: try_rankings_page(client, st), starts))
+        else:
+            pages = [try_rankings_page(client, start)]
+
+        for parsed in pages:
+            if parsed is None:
+                done = True
                 break
 
             parsed_last = parsed if isinstance(parsed, dict) else {}
             chunk = _extract_kingdoms(parsed)
             if not chunk:
+                done = True
                 break
 
             added_this_page = 0
@@ -384,8 +456,14 @@ def _poll_rankings_once(*, world_id: str, creds: Dict[str, object]) -> Tuple[int
                     break
 
             start += max(1, len(chunk))
-            if added_this_page == 0:
+            if added_this_page == 0 or len(all_rows) >= 300:
+                done = added_this_page == 0
+                break
+            if len(chunk) != page_size:
+                # A short/odd page shifts every later offset; refetch from here.
+                page_size = len(chunk)
                 break
+        if not done and len(all_rows) < 300:
             time.sleep(0.12)
 
     if not all_rows:
@@ -394,6 +472,7 @@ def _poll_rankings_once(*, world_id: str, creds: Dict[str, object]) -> Tuple[int
 
     fetched_at = datetime.now(timezone.utc)
     _upsert_top(all_rows[:300], fetched_at=fetched_at)
+    invalidate_kingdoms_cache()
 
     # Debug Galileo NW if present
     gal_nw = None
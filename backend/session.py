@@ -0,0 +1,103 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Tuple
+
+import jwt
+from fastapi import HTTPException
+from jwt.utils import base64url_encode
+
+JWT_COOKIE_NAME = "rh_session"
+
+
+# -------------------------
+# Session JWT decoding (shared by the API routers)
+# -------------------------
+def jwt_secret() -> str:
+    secret = os.getenv("JWT_SECRET", "").strip()
+    if not secret:
+        raise HTTPException(status_code=500, detail="JWT_SECRET is not set")
+    return secret
+
+
+# HMAC key for the session JWTs, built once per secret so encode/decode skip
+# PyJWT's per-call key preparation.
+_SIGNING_KEYS: Dict[str, jwt.PyJWK] = {}
+
+
+def session_signing_key() -> jwt.PyJWK:
+    secret = jwt_secret()
+    key = _SIGNING_KEYS.get(secret)
+    if key is None:
+        key = jwt.PyJWK({"kty": "oct", "k": base64url_encode(secret.encode("utf-8")).decode("ascii")}, algorithm="HS256")
+        _SIGNING_KEYS.clear()
+        _SIGNING_KEYS[secret] = key
+    return key
+
+
+# The same browser presents the same token on every request, so verified
+# claims are kept for a short while keyed by a hash of the token (never the
+# token itself). Entries never outlive the token's own exp.
+SESSION_CACHE_SIZE = max(0, int(os.getenv("SESSION_CACHE_SIZE", "10000")))
+SESSION_CACHE_TTL_SECONDS = max(0, int(os.getenv("SESSION_CACHE_TTL_SECONDS", "60")))
+_session_cache: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_session_cache_lock = threading.Lock()
+
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()[:16]
+
+
+def decode_session_jwt(token: str) -> Dict[str, Any]:
+    # Cookies that can't be a compact JWS (header.payload.signature) are
+    # rejected before hashing or HMAC work.
+    if not 20 <= len(token) <= 4096 or token.count(".") != 2:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    caching = SESSION_CACHE_SIZE > 0 and SESSION_CACHE_TTL_SECONDS > 0
+    key = _token_key(token) if caching else b""
+    now = time.time()
+    if caching:
+        with _session_cache_lock:
+            hit = _session_cache.get(key)
+            if hit is not None:
+                if hit[0] > now:
+                    _session_cache.move_to_end(key)
+                    return hit[1]
+                del _session_cache[key]
+
+    try:
+        claims = jwt.decode(token, session_signing_key(), algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid session")
+
+    if caching:
+        expires_at = now + SESSION_CACHE_TTL_SECONDS
+        exp = claims.get("exp")
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, float(exp))
+        with _session_cache_lock:
+            _session_cache[key] = (expires_at, claims)
+            if len(_session_cache) > SESSION_CACHE_SIZE:
+                _session_cache.popitem(last=False)
+    return claims
+
+
+def forget_session(token: str) -> None:
+    """Drop a token's cached claims (logout)."""
+    if not token:
+        return
+    with _session_cache_lock:
+        _session_cache.pop(_token_key(token), None)
+
+
+@lru_cache(maxsize=4)
+def _parse_user_ids(raw: str) -> FrozenSet[str]:
+    return frozenset(x.strip() for x in raw.split(",") if x.strip())
+
+
+def admin_user_ids() -> FrozenSet[str]:
+    """DEV_USER_IDS as a set; parsed once per distinct value rather than per request."""
+    return _parse_user_ids(os.getenv("DEV_USER_IDS", "").strip())
@@ -3,7 +3,14 @@ CREATE TABLE IF NOT EXISTS nw_history (
     networth BIGINT NOT NULL,
     tick_time TIMESTAMPTZ NOT NULL,
     PRIMARY KEY (kingdom, tick_time)
-);
+) PARTITION BY RANGE (tick_time);
+-- Monthly partitions (nw_history_YYYY_MM) are created ahead of time by nw_poll.
 
 CREATE INDEX IF NOT EXISTS nw_history_kingdom_time_idx
 ON nw_history (kingdom, tick_time DESC);
+
+CREATE INDEX IF NOT EXISTS nw_history_kingdom_time_cover_idx
+ON nw_history (kingdom, tick_time) INCLUDE (networth);
+
+CREATE INDEX IF NOT EXISTS nw_history_tick_time_idx
+ON nw_history (tick_time);